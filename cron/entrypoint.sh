@@ -2,6 +2,7 @@
 
 echo TZ=$TZ >> /etc/environment
 echo DB_URL=$DB_URL >> /etc/environment
+echo REDIS_URL=$REDIS_URL >> /etc/environment
 echo AUTH_TOKEN=$AUTH_TOKEN >> /etc/environment
 
 # Create log file if not exists
@@ -1,13 +1,18 @@
 import os
 import re
 
+import numpy as np
 from aiohttp import ClientSession
 from pylife_api import PylifeAPIClient
+from redis.exceptions import RedisError
 from shapely.geometry import box
 from shapely.ops import unary_union
 from tortoise import Tortoise, connections, run_async
 
-from mapapylife.models import Blip, House, Player, Organization, Zone
+from mapapylife.cache import bump_versions, get_redis
+from mapapylife.coords import to_map
+from mapapylife.models import Blip, House, Player, Organization, Zone, get_fingerprint
+from mapapylife.zones import zone_registry
 
 MTA_ZONENAMES = "https://github.com/multitheftauto/mtasa-blue/raw/master/Shared/mods/deathmatch/logic/CZoneNames.cpp"
 ZONE_REGEX = r"{(-?\d+), (-?\d+), (?:-?\d+), (-?\d+), (-?\d+), (?:-?\d+), \"(.*?)\"}"
@@ -107,8 +112,9 @@ async def generate_organizations(client: PylifeAPIClient):
             id=organization.id,
             name=organization.name,
             tag=organization.tag,
-            logo_url=organization.logo,
+            logo_url=str(organization.logo) if organization.logo else None,
             registered=organization.registered,
+            fingerprint=get_fingerprint(Organization, organization),
         )
 
 
@@ -123,27 +129,44 @@ async def generate_players(client: PylifeAPIClient):
             premium=player.premium,
             registered=player.registered,
             last_online=player.last_online,
+            fingerprint=get_fingerprint(Player, player),
         )
 
 
 async def generate_houses(client: PylifeAPIClient):
     print("Generating table for houses...")
 
-    # Pull houses from API and save them to database
-    for house in await client.get_houses():
-        # Get zone from house position
-        zone = await Zone.get_zone(house.position.x, house.position.y)
+    # Pull houses from API
+    houses = await client.get_houses()
 
+    # Get zones from house positions in one batch
+    await zone_registry.load()
+    zones = zone_registry.locate_many(
+        [house.position.x for house in houses],
+        [house.position.y for house in houses],
+    )
+
+    # Convert positions to map coordinates in one batch
+    map_xs, map_ys = to_map(
+        np.array([house.position.x for house in houses], dtype=np.float64),
+        np.array([house.position.y for house in houses], dtype=np.float64),
+    )
+
+    # Save houses to database
+    for house, zone, map_x, map_y in zip(houses, zones, map_xs.tolist(), map_ys.tolist()):
         await House.create(
             id=house.id,
             x=house.position.x,
             y=house.position.y,
+            map_x=map_x,
+            map_y=map_y,
             title=house.title,
-            location_id=zone.id,
+            location_id=zone.id if zone else None,
             owner_id=house.owner,
             organization_id=house.organization,
             price=house.price,
             expires=house.expires,
+            fingerprint=get_fingerprint(House, house),
         )
 
 
@@ -159,7 +182,9 @@ async def generate_blips():
                 continue
 
             blip = line.split(",")
-            await Blip.create(x=blip[0], y=blip[1], name=blip[2], icon=blip[3])
+            x, y = float(blip[0]), float(blip[1])
+            map_x, map_y = to_map(x, y)
+            await Blip.create(x=x, y=y, map_x=map_x, map_y=map_y, name=blip[2], icon=blip[3])
 
 
 async def run():
@@ -186,6 +211,13 @@ async def run():
     # Generate blips
     await generate_blips()
 
+    # Invalidate snapshots cached by running API workers
+    try:
+        await bump_versions("houses", "blips", "events", "zones", "players", "organizations", "search")
+        await get_redis().close()
+    except RedisError:
+        print("Could not connect to Redis, API has to be restarted to see new data!")
+
     # Close database connection
     await connections.close_all()
 
@@ -4,94 +4,223 @@ CREATE EXTENSION IF NOT EXISTS pg_trgm;
 -- Fix timestamp precision for last_update
 ALTER TABLE map_houses ALTER last_update TYPE timestamptz(0);
 
--- Table: map_index_houses
-CREATE TABLE IF NOT EXISTS map_index_houses (
-    id SERIAL PRIMARY KEY,
+-- Add fingerprints of API fields to tables created before they were introduced
+ALTER TABLE map_houses ADD COLUMN IF NOT EXISTS fingerprint BIGINT;
+ALTER TABLE map_players ADD COLUMN IF NOT EXISTS fingerprint BIGINT;
+ALTER TABLE map_organizations ADD COLUMN IF NOT EXISTS fingerprint BIGINT;
+
+-- Add map coordinates to tables created before they were introduced
+ALTER TABLE map_houses ADD COLUMN IF NOT EXISTS map_x DOUBLE PRECISION;
+ALTER TABLE map_houses ADD COLUMN IF NOT EXISTS map_y DOUBLE PRECISION;
+UPDATE map_houses SET map_x = 3000 + x, map_y = 3000 - y WHERE map_x IS NULL OR map_y IS NULL;
+ALTER TABLE map_houses ALTER map_x SET NOT NULL, ALTER map_y SET NOT NULL;
+
+ALTER TABLE map_blips ADD COLUMN IF NOT EXISTS map_x DOUBLE PRECISION;
+ALTER TABLE map_blips ADD COLUMN IF NOT EXISTS map_y DOUBLE PRECISION;
+UPDATE map_blips SET map_x = 3000 + x, map_y = 3000 - y WHERE map_x IS NULL OR map_y IS NULL;
+ALTER TABLE map_blips ALTER map_x SET NOT NULL, ALTER map_y SET NOT NULL;
+
+-- Add index of house positions to tables created before it was introduced
+CREATE INDEX IF NOT EXISTS idx_map_houses_x_5bf4ca ON map_houses (x, y);
+
+-- Add index of change times to tables created before it was introduced, old changes are pruned by the worker
+CREATE INDEX IF NOT EXISTS idx_map_house_c_created_adf502 ON map_house_changes (created);
+
+-- Remove search index tables replaced by map_search_index
+DROP TRIGGER IF EXISTS update_index_houses ON map_houses;
+DROP TRIGGER IF EXISTS update_index_zones ON map_zones;
+DROP FUNCTION IF EXISTS update_index_houses();
+DROP FUNCTION IF EXISTS update_index_zones();
+DROP TABLE IF EXISTS map_index_houses;
+DROP TABLE IF EXISTS map_index_zones;
+
+-- Table: map_search_index
+CREATE TABLE IF NOT EXISTS map_search_index (
+    group_ VARCHAR(16) NOT NULL,
+    id INT NOT NULL,
     name TEXT NOT NULL,
     tsv TSVECTOR NOT NULL,
-    FOREIGN KEY (id) REFERENCES map_houses(id) ON DELETE CASCADE
+    PRIMARY KEY (group_, id)
 );
 
--- Index: map_index_houses_tsv_idx
-CREATE INDEX map_index_houses_tsv_idx
-    ON map_index_houses USING gin(tsv);
+-- Index: map_search_index_tsv_idx
+CREATE INDEX IF NOT EXISTS map_search_index_tsv_idx
+    ON map_search_index USING gin(tsv);
+
+-- Index: map_search_index_name_trgm_idx, GiST also serves ordering by similarity
+CREATE INDEX IF NOT EXISTS map_search_index_name_trgm_idx
+    ON map_search_index USING gist(name gist_trgm_ops);
+
+-- Function: upsert_search_index(text, integer, text)
+CREATE OR REPLACE FUNCTION upsert_search_index(group_name text, row_id integer, new_name text) RETURNS void AS $$
+BEGIN
+    INSERT INTO map_search_index (group_, id, name, tsv)
+        VALUES (group_name, row_id, new_name, to_tsvector('simple', new_name))
+        ON CONFLICT (group_, id)
+        DO UPDATE SET name = EXCLUDED.name, tsv = EXCLUDED.tsv
+        WHERE map_search_index.name <> EXCLUDED.name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function: delete_search_index(), group is passed as trigger argument
+CREATE OR REPLACE FUNCTION delete_search_index() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM map_search_index WHERE group_ = TG_ARGV[0] AND id = OLD.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
--- Function: update_index_houses()
-CREATE OR REPLACE FUNCTION update_index_houses() RETURNS trigger AS $$
+-- Function: update_search_houses()
+CREATE OR REPLACE FUNCTION update_search_houses() RETURNS trigger AS $$
 DECLARE
     location_name text;
-    new_name text;
-    new_tsv tsvector;
 BEGIN
     -- Check if row has changed or is new
-    IF (OLD IS NULL OR OLD.title <> NEW.title OR OLD.location_id <> NEW.location_id) THEN
-        -- Check if location_id is null, and set location_name accordingly
-        IF NEW.location_id IS NOT NULL THEN
-            SELECT name INTO location_name FROM map_zones WHERE id = NEW.location_id;
-        ELSE
-            location_name := 'San Andreas';
-        END IF;
-
-        -- Assign values from new row
-        new_name := NEW.id || '. ' || NEW.title || ' (' || location_name || ')';
-        new_tsv := to_tsvector('simple', new_name);
-
-        -- Insert or update row in index table
-        INSERT INTO map_index_houses (id, name, tsv)
-            VALUES (NEW.id, new_name, new_tsv)
-            ON CONFLICT (id)
-            DO UPDATE SET name = new_name, tsv = new_tsv;
+    IF (OLD IS NULL OR OLD.title <> NEW.title OR OLD.location_id IS DISTINCT FROM NEW.location_id) THEN
+        SELECT name INTO location_name FROM map_zones WHERE id = NEW.location_id;
+        PERFORM upsert_search_index('houses', NEW.id, NEW.id || '. ' || NEW.title || ' (' || COALESCE(location_name, 'San Andreas') || ')');
     END IF;
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
--- Trigger: update_index_houses
-CREATE TRIGGER update_index_houses
-    AFTER INSERT OR UPDATE ON map_houses
-    FOR EACH ROW
-    EXECUTE FUNCTION update_index_houses();
+-- Function: update_search_zones()
+CREATE OR REPLACE FUNCTION update_search_zones() RETURNS trigger AS $$
+DECLARE
+    root_name text;
+BEGIN
+    -- Check if row has changed or is new
+    IF (OLD IS NULL OR OLD.name <> NEW.name OR OLD.root_id IS DISTINCT FROM NEW.root_id) THEN
+        SELECT name INTO root_name FROM map_zones WHERE id = NEW.root_id;
+        PERFORM upsert_search_index('zones', NEW.id, NEW.name || COALESCE(', ' || root_name, ''));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
--- Table: map_index_zones
-CREATE TABLE IF NOT EXISTS map_index_zones (
-    id SERIAL PRIMARY KEY,
-    name TEXT NOT NULL,
-    tsv TSVECTOR NOT NULL,
-    FOREIGN KEY (id) REFERENCES map_zones(id) ON DELETE CASCADE
-);
+-- Function: update_search_players()
+CREATE OR REPLACE FUNCTION update_search_players() RETURNS trigger AS $$
+BEGIN
+    IF (OLD IS NULL OR OLD.login <> NEW.login) THEN
+        PERFORM upsert_search_index('players', NEW.id, NEW.login);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
--- Index: map_index_zones_tsv_idx
-CREATE INDEX map_index_zones_tsv_idx
-    ON map_index_zones USING gin(tsv);
+-- Function: update_search_organizations()
+CREATE OR REPLACE FUNCTION update_search_organizations() RETURNS trigger AS $$
+BEGIN
+    IF (OLD IS NULL OR OLD.name <> NEW.name OR OLD.tag <> NEW.tag) THEN
+        PERFORM upsert_search_index('organizations', NEW.id, NEW.name || ' [' || NEW.tag || ']');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function: update_search_blips()
+CREATE OR REPLACE FUNCTION update_search_blips() RETURNS trigger AS $$
+BEGIN
+    IF (OLD IS NULL OR OLD.name <> NEW.name) THEN
+        PERFORM upsert_search_index('blips', NEW.id, NEW.name);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
--- Function: update_index_zones()
-CREATE OR REPLACE FUNCTION update_index_zones() RETURNS trigger AS $$
+-- Function: update_search_events()
+CREATE OR REPLACE FUNCTION update_search_events() RETURNS trigger AS $$
 DECLARE
     location_name text;
-    new_name text;
 BEGIN
-    -- Check if row has changed or is new
-    IF (OLD IS NULL OR OLD.name <> NEW.name OR OLD.root_id IS DISTINCT FROM NEW.root_id) THEN
-        new_name := NEW.name;
-
-        -- Append root zone name if exists
-        IF (NEW.root_id IS NOT NULL) THEN
-            SELECT name INTO location_name FROM map_zones WHERE id = NEW.root_id;
-            new_name := new_name || ', ' || location_name;
-        END IF;
-
-        -- Insert or update row in index table
-        INSERT INTO map_index_zones (id, name, tsv)
-            VALUES (NEW.id, new_name, to_tsvector('simple', new_name))
-            ON CONFLICT (id)
-            DO UPDATE SET name = new_name, tsv = to_tsvector('simple', new_name);
+    IF (OLD IS NULL OR OLD.name <> NEW.name OR OLD.location_id <> NEW.location_id) THEN
+        SELECT name INTO location_name FROM map_zones WHERE id = NEW.location_id;
+        PERFORM upsert_search_index('events', NEW.id, NEW.name || ' (' || location_name || ')');
     END IF;
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
--- Trigger: update_index_zones
-CREATE TRIGGER update_index_zones
+-- Triggers keeping search index up to date with indexed tables
+DROP TRIGGER IF EXISTS update_search_houses ON map_houses;
+CREATE TRIGGER update_search_houses
+    AFTER INSERT OR UPDATE ON map_houses
+    FOR EACH ROW
+    EXECUTE FUNCTION update_search_houses();
+
+DROP TRIGGER IF EXISTS delete_search_houses ON map_houses;
+CREATE TRIGGER delete_search_houses
+    AFTER DELETE ON map_houses
+    FOR EACH ROW
+    EXECUTE FUNCTION delete_search_index('houses');
+
+DROP TRIGGER IF EXISTS update_search_zones ON map_zones;
+CREATE TRIGGER update_search_zones
     AFTER INSERT OR UPDATE ON map_zones
     FOR EACH ROW
-    EXECUTE FUNCTION update_index_zones();
+    EXECUTE FUNCTION update_search_zones();
+
+DROP TRIGGER IF EXISTS delete_search_zones ON map_zones;
+CREATE TRIGGER delete_search_zones
+    AFTER DELETE ON map_zones
+    FOR EACH ROW
+    EXECUTE FUNCTION delete_search_index('zones');
+
+DROP TRIGGER IF EXISTS update_search_players ON map_players;
+CREATE TRIGGER update_search_players
+    AFTER INSERT OR UPDATE ON map_players
+    FOR EACH ROW
+    EXECUTE FUNCTION update_search_players();
+
+DROP TRIGGER IF EXISTS delete_search_players ON map_players;
+CREATE TRIGGER delete_search_players
+    AFTER DELETE ON map_players
+    FOR EACH ROW
+    EXECUTE FUNCTION delete_search_index('players');
+
+DROP TRIGGER IF EXISTS update_search_organizations ON map_organizations;
+CREATE TRIGGER update_search_organizations
+    AFTER INSERT OR UPDATE ON map_organizations
+    FOR EACH ROW
+    EXECUTE FUNCTION update_search_organizations();
+
+DROP TRIGGER IF EXISTS delete_search_organizations ON map_organizations;
+CREATE TRIGGER delete_search_organizations
+    AFTER DELETE ON map_organizations
+    FOR EACH ROW
+    EXECUTE FUNCTION delete_search_index('organizations');
+
+DROP TRIGGER IF EXISTS update_search_blips ON map_blips;
+CREATE TRIGGER update_search_blips
+    AFTER INSERT OR UPDATE ON map_blips
+    FOR EACH ROW
+    EXECUTE FUNCTION update_search_blips();
+
+DROP TRIGGER IF EXISTS delete_search_blips ON map_blips;
+CREATE TRIGGER delete_search_blips
+    AFTER DELETE ON map_blips
+    FOR EACH ROW
+    EXECUTE FUNCTION delete_search_index('blips');
+
+DROP TRIGGER IF EXISTS update_search_events ON map_events;
+CREATE TRIGGER update_search_events
+    AFTER INSERT OR UPDATE ON map_events
+    FOR EACH ROW
+    EXECUTE FUNCTION update_search_events();
+
+DROP TRIGGER IF EXISTS delete_search_events ON map_events;
+CREATE TRIGGER delete_search_events
+    AFTER DELETE ON map_events
+    FOR EACH ROW
+    EXECUTE FUNCTION delete_search_index('events');
+
+-- Fill search index with rows existing before triggers were created
+SELECT upsert_search_index('houses', h.id, h.id || '. ' || h.title || ' (' || COALESCE(z.name, 'San Andreas') || ')')
+    FROM map_houses h LEFT JOIN map_zones z ON z.id = h.location_id;
+SELECT upsert_search_index('zones', z.id, z.name || COALESCE(', ' || r.name, ''))
+    FROM map_zones z LEFT JOIN map_zones r ON r.id = z.root_id;
+SELECT upsert_search_index('players', id, login) FROM map_players;
+SELECT upsert_search_index('organizations', id, name || ' [' || tag || ']') FROM map_organizations;
+SELECT upsert_search_index('blips', id, name) FROM map_blips;
+SELECT upsert_search_index('events', e.id, e.name || ' (' || z.name || ')')
+    FROM map_events e JOIN map_zones z ON z.id = e.location_id;
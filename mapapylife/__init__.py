@@ -1,12 +1,17 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi_limiter import FastAPILimiter
-from redis import asyncio as aioredis
 from tortoise import Tortoise, connections
 
 from mapapylife.api import v1
+from mapapylife.cache import get_redis
 from mapapylife.config import get_settings
+from mapapylife.db import get_pool_metrics, get_tortoise_config
+from mapapylife.limiter import rate_limit_store
 from mapapylife.routes import index, widget
+from mapapylife.search import get_search_backend
+from mapapylife.stream import house_broadcaster
+from mapapylife.zones import zone_registry
 
 
 def get_application() -> FastAPI:
@@ -26,34 +31,30 @@ def get_application() -> FastAPI:
         openapi_url="/api/openapi.json",
     )
 
-    redis = aioredis.from_url(settings.redis_url, encoding="utf8", decode_responses=True)
-
-    async def limiter_identifier(request: Request):
-        forwarded = request.headers.get("X-Forwarded-For")
-
-        if forwarded:
-            ip_address = forwarded.split(",")[0]
-        else:
-            ip_address = request.client.host
-
-        return ip_address
+    redis = get_redis()
 
     @app.middleware("http")
     async def add_cache_control_header(request: Request, call_next):
         response = await call_next(request)
 
+        # Routes serving immutable responses set their own policy
         if request.url.path.startswith("/api/"):
-            response.headers["Cache-Control"] = "no-cache"
+            response.headers.setdefault("Cache-Control", "no-cache")
 
         return response
 
     @app.on_event("startup")
     async def startup_event():
-        await Tortoise.init(db_url=settings.db_url, modules={"models": ["mapapylife.models"]})
-        await FastAPILimiter.init(redis, identifier=limiter_identifier)
+        await Tortoise.init(config=get_tortoise_config())
+        await zone_registry.refresh()
+        await get_search_backend().start()
+        await rate_limit_store.start()
+        await house_broadcaster.start()
 
     @app.on_event("shutdown")
     async def shutdown_event():
+        await house_broadcaster.stop()
+        await rate_limit_store.stop()
         await connections.close_all()
         await redis.close()
 
@@ -64,6 +65,11 @@ def get_application() -> FastAPI:
             "message": "healthy",
         }
 
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        # Metrics are kept per process, every worker of the server reports its own pools
+        return PlainTextResponse("\n".join(get_pool_metrics()) + "\n", media_type="text/plain; version=0.0.4")
+
     app.include_router(v1.router)
     app.include_router(index.router)
     app.include_router(widget.router)
@@ -1,15 +1,14 @@
 from fastapi import APIRouter, Depends
-from fastapi_limiter.depends import RateLimiter
 
-from mapapylife.api.v1.routes import lookup, points, search
+from mapapylife.api.v1.routes import lookup, points, search, tiles
+from mapapylife.limiter import RateLimiter
 
-router = APIRouter(
-    prefix="/api/v1",
-    dependencies=[
-        Depends(RateLimiter(times=45, seconds=60)),
-    ],
-)
+router = APIRouter(prefix="/api/v1")
 
-router.include_router(lookup.router)
-router.include_router(points.router)
-router.include_router(search.router)
+# Limits are requests per minute to every route, they can be overridden with RATE_LIMITS setting
+router.include_router(lookup.router, dependencies=[Depends(RateLimiter("lookup", times=45))])
+router.include_router(points.router, dependencies=[Depends(RateLimiter("points", times=45))])
+router.include_router(search.router, dependencies=[Depends(RateLimiter("search", times=45))])
+
+# Tiles are requested in parallel, many at once for a single view
+router.include_router(tiles.router, dependencies=[Depends(RateLimiter("tiles", times=600))])
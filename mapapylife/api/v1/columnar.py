@@ -0,0 +1,82 @@
+from datetime import datetime
+from typing import Any, Dict, Optional, Sequence
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+import numpy as np
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+# Missing integers are stored as -1, missing floats and timestamps as NaN
+NULL_INTEGER = -1
+
+
+def pack_integers(values: Sequence[Optional[int]]) -> bytes:
+    return np.array([NULL_INTEGER if value is None else value for value in values], dtype="<i4").tobytes()
+
+
+def pack_floats(values: Sequence[Optional[float]]) -> bytes:
+    return np.array([np.nan if value is None else float(value) for value in values], dtype="<f8").tobytes()
+
+
+def pack_timestamps(values: Sequence[Optional[datetime]]) -> bytes:
+    return pack_floats([value.timestamp() if value else None for value in values])
+
+
+def pack_strings(values: Sequence[Optional[str]]) -> Dict[str, Any]:
+    """Dictionary-encode strings, as most of them repeat"""
+    dictionary: Dict[str, int] = {}
+    codes = [NULL_INTEGER if value is None else dictionary.setdefault(value, len(dictionary)) for value in values]
+    return {"dictionary": list(dictionary), "codes": np.array(codes, dtype="<i4").tobytes()}
+
+
+def pack(count: int, columns: Dict[str, Any], **meta) -> bytes:
+    return msgpack.packb({"count": count, "columns": columns, **meta}, use_bin_type=True)
+
+
+def pack_houses(response: Dict[str, Any]) -> bytes:
+    """Pack houses, in the shape of HousesResponseV1, into columns of little-endian arrays"""
+    houses = response["data"]
+    locations = [house["location"] or {} for house in houses]
+    owners = [house["owner"] or {} for house in houses]
+    organizations = [house["organization"] or {} for house in houses]
+
+    columns = {
+        "id": pack_integers([house["id"] for house in houses]),
+        "x": pack_floats([house["x"] for house in houses]),
+        "y": pack_floats([house["y"] for house in houses]),
+        "title": pack_strings([house["title"] for house in houses]),
+        "location_id": pack_integers([location.get("id") for location in locations]),
+        "location_name": pack_strings([location.get("name") for location in locations]),
+        "location_root": pack_strings([location.get("root_name") for location in locations]),
+        "owner_id": pack_integers([owner.get("id") for owner in owners]),
+        "owner_name": pack_strings([owner.get("name") for owner in owners]),
+        "owner_premium": pack_timestamps([owner.get("premium") for owner in owners]),
+        "organization_id": pack_integers([organization.get("id") for organization in organizations]),
+        "organization_name": pack_strings([organization.get("name") for organization in organizations]),
+        "organization_logo_url": pack_strings([organization.get("logo_url") for organization in organizations]),
+        "price": pack_floats([house["price"] for house in houses]),
+        "expires": pack_timestamps([house["expires"] for house in houses]),
+        "last_update": pack_timestamps([house["last_update"] for house in houses]),
+    }
+
+    last_update = response["last_update"].timestamp() if response["last_update"] else None
+    return pack(len(houses), columns, last_update=last_update, cursor=response["cursor"])
+
+
+def pack_blips(response: Dict[str, Any]) -> bytes:
+    """Pack blips, in the shape of BlipsResponseV1, into columns of little-endian arrays"""
+    blips = response["data"]
+
+    columns = {
+        "id": pack_integers([blip["id"] for blip in blips]),
+        "x": pack_floats([blip["x"] for blip in blips]),
+        "y": pack_floats([blip["y"] for blip in blips]),
+        "name": pack_strings([blip["name"] for blip in blips]),
+        "icon": pack_strings([blip["icon"] for blip in blips]),
+    }
+
+    return pack(len(blips), columns)
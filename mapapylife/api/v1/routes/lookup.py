@@ -1,8 +1,9 @@
+import numpy as np
 from fastapi import APIRouter, HTTPException
-from shapely import Point
 
-from mapapylife.api.v1.schemas import LookupResultV1
-from mapapylife.models import Zone
+from mapapylife.api.v1.schemas import LookupBatchRequestV1, LookupBatchResponseV1, LookupResultV1
+from mapapylife.coords import to_raw
+from mapapylife.zones import zone_registry
 
 router = APIRouter(prefix="/lookup", tags=["lookup"])
 
@@ -10,11 +11,35 @@ router = APIRouter(prefix="/lookup", tags=["lookup"])
 @router.get("/")
 async def lookup(x: float, y: float, raw: bool = False) -> LookupResultV1:
     """Lookup a zone by coordinates"""
-    zones = await Zone.all().order_by("root_id").prefetch_related("root")
-    point = Point(x, y) if raw else Point(x - 3000, 3000 - y)
+    await zone_registry.refresh()
 
-    for zone in zones:
-        if point in zone:
-            return LookupResultV1.model_validate(zone, from_attributes=True)
+    zone = zone_registry.locate(x, y) if raw else zone_registry.locate(*to_raw(x, y))
 
-    raise HTTPException(status_code=404, detail="Zone not found")
+    if not zone:
+        raise HTTPException(status_code=404, detail="Zone not found")
+
+    return LookupResultV1.model_validate(zone, from_attributes=True)
+
+
+@router.post("/batch")
+async def lookup_batch(batch: LookupBatchRequestV1) -> LookupBatchResponseV1:
+    """Lookup zones for many coordinates at once"""
+    await zone_registry.refresh()
+
+    points = np.array(batch.points, dtype=np.float64).reshape(-1, 2)
+    xs, ys = points[:, 0], points[:, 1]
+
+    if not batch.raw:
+        xs, ys = to_raw(xs, ys)
+
+    # Results are shared between points located in the same zone
+    results = {}
+    data = []
+
+    for zone in zone_registry.locate_many(xs, ys):
+        if zone and zone.id not in results:
+            results[zone.id] = LookupResultV1.model_validate(zone, from_attributes=True)
+
+        data.append(results[zone.id] if zone else None)
+
+    return LookupBatchResponseV1(data=data)
@@ -1,93 +1,379 @@
+import asyncio
+import time
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, Any, Dict, List, Literal, Optional, Tuple, Union
 
-from fastapi import APIRouter
+import numpy as np
+import shapely
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pypika import Parameter
+from shapely import STRtree
 from tortoise.expressions import Q
 
+from mapapylife.api.v1.columnar import MSGPACK_MEDIA_TYPE, msgpack, pack_blips, pack_houses
+from mapapylife.api.v1.serializers import dumps, serialize_house
 from mapapylife.api.v1.schemas import (
-    BlipV1,
     BlipsResponseV1,
+    ClusterV1,
+    ClustersResponseV1,
+    EncodedZoneV1,
+    EncodedZonesResponseV1,
     EventV1,
     EventsResponseV1,
-    HouseV1,
+    HouseChangesResponseV1,
     HousesResponseV1,
     ZoneV1,
     ZonesResponseV1,
 )
-from mapapylife.models import Blip, Event, House, Zone
+from mapapylife.cache import EVENTS_MAX_AGE, Snapshot, SnapshotCache, parse_accept
+from mapapylife.clusters import house_clusters
+from mapapylife.coords import to_map, to_map_geometries, to_raw, to_raw_bbox
+from mapapylife.models import Blip, ChangeAction, Event, HouseChange, Zone
+from mapapylife.readmodels import query_house_rows
+from mapapylife.stream import house_broadcaster
+from mapapylife.zones import MAX_ZOOM, MIN_ZOOM, encode_polyline, get_tolerance, simplify_zones
 
 router = APIRouter(prefix="/points", tags=["points"])
+snapshots = SnapshotCache()
 
+# Interval of keep-alive comments sent to streaming clients
+STREAM_HEARTBEAT = 15
 
-@router.get("/houses")
-async def get_houses(raw: bool = False, last_update: Optional[datetime] = None) -> HousesResponseV1:
-    """Get all houses"""
-    houses = House.all().order_by("id").prefetch_related("location", "location__root", "owner", "organization")
+# Clients wait before querying again, when notified changes were not found
+STREAM_RETRY_DELAY = 1
+
+# Point datasets can be also requested in columnar format
+COLUMNAR_RESPONSES = {200: {"content": {MSGPACK_MEDIA_TYPE: {}}}}
+
+
+def accepts_msgpack(request: Request) -> bool:
+    return msgpack is not None and bool({MSGPACK_MEDIA_TYPE, "application/msgpack"} & parse_accept(request.headers.get("Accept")))
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    try:
+        x1, y1, x2, y2 = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Bounding box must be given as minx,miny,maxx,maxy")
+
+    # Corners may be given in any order, as Y axis is flipped in map coordinates
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+class HouseIndex:
+    """Spatial index of serialized houses, built once per version of houses"""
+
+    def __init__(self, response: Dict[str, Any]):
+        self.response = response
+        self.ids = np.array([house["id"] for house in response["data"]], dtype=np.int64)
+        self.tree = STRtree(shapely.points(
+            np.array([(house["x"], house["y"]) for house in response["data"]], dtype=np.float64).reshape(-1, 2)
+        ))
+
+    def query(self, bbox: Tuple[float, float, float, float], after: int = 0, limit: int = 1000) -> Dict[str, Any]:
+        # Houses are ordered by ID, so sorted indices keep pages in the same order
+        indices = np.sort(self.tree.query(shapely.box(*bbox)))
+        indices = indices[self.ids[indices] > after]
+        data = [self.response["data"][index] for index in indices[:limit].tolist()]
+
+        last_update = max(house["last_update"] for house in data) if data else None
+        return {"data": data, "last_update": last_update, "cursor": self.response["cursor"], "has_more": len(indices) > limit}
+
+
+async def query_houses(
+    raw: bool = False,
+    last_update: Optional[datetime] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    after: int = 0,
+    limit: int = 1000,
+) -> Dict[str, Any]:
+    """Get houses in the shape of HousesResponseV1"""
+    # Cursor is read first, so changes made in the meantime are replayed rather than lost
+    cursor = await HouseChange.get_cursor()
+    filters = {}
 
     if last_update:
-        houses = houses.filter(last_update__gt=last_update)
+        filters["last_update__gt"] = last_update
 
-    houses = await houses
-    data = []
+    if bbox:
+        minx, miny, maxx, maxy = bbox if raw else to_raw_bbox(bbox)
+        filters.update(x__gte=minx, x__lte=maxx, y__gte=miny, y__lte=maxy, id__gt=after)
 
-    for house in houses:
-        if not raw:
-            house.x = 3000 + house.x
-            house.y = 3000 - house.y
+    # Relations are joined into flat rows, instead of being fetched and validated as objects
+    houses = query_house_rows(**filters)
 
-        data.append(HouseV1.model_validate(house, from_attributes=True))
+    # Houses within bounding box are returned in pages, one more house tells if there are more of them
+    if bbox:
+        houses = houses.limit(limit + 1)
 
-    last_update = max(houses, key=lambda h: h.last_update).last_update if houses else None
-    return HousesResponseV1(data=data, last_update=last_update)
+    rows = await houses
+    has_more = bool(bbox) and len(rows) > limit
 
+    if has_more:
+        rows = rows[:limit]
 
-@router.get("/blips")
-async def get_blips(raw: bool = False) -> BlipsResponseV1:
-    """Get all blips"""
-    blips = await Blip.all().order_by("id")
-    data = []
+    data = [serialize_house(row, raw) for row in rows]
 
-    for blip in blips:
-        if not raw:
-            blip.x = 3000 + blip.x
-            blip.y = 3000 - blip.y
+    last_update = max(row["last_update"] for row in rows) if rows else None
+    return {"data": data, "last_update": last_update, "cursor": cursor, "has_more": has_more}
 
-        data.append(BlipV1.model_validate(blip, from_attributes=True))
 
-    return BlipsResponseV1(data=data)
+async def query_house_changes(since: int, raw: bool = False, limit: int = 1000) -> Dict[str, Any]:
+    """Get changes of houses in the shape of HouseChangesResponseV1"""
+    # Clients behind the oldest kept change missed some of them, so they have to load all houses again
+    if await HouseChange.is_pruned(since):
+        return {"data": [], "deleted": [], "cursor": await HouseChange.get_cursor(), "has_more": False, "resync": True}
 
+    changes = await HouseChange.filter(id__gt=since).order_by("id").limit(limit)
+    actions = {}
 
-@router.get("/events")
-async def get_events(raw: bool = False) -> EventsResponseV1:
-    """Get all events"""
+    # Only the latest action of every house matters
+    for change in changes:
+        actions[change.house_id] = change.action
+
+    upserted = [house_id for house_id, action in actions.items() if action == ChangeAction.UPSERT]
+    deleted = [house_id for house_id, action in actions.items() if action == ChangeAction.DELETE]
+
+    rows = await query_house_rows(id__in=upserted) if upserted else []
+
+    return {
+        "data": [serialize_house(row, raw) for row in rows],
+        "deleted": sorted(deleted),
+        "cursor": changes[-1].id if changes else since,
+        "has_more": len(changes) == limit,
+        "resync": False,
+    }
+
+
+async def query_house_clusters(zoom: int, raw: bool = False, bbox: Optional[Tuple[float, float, float, float]] = None) -> ClustersResponseV1:
+    await house_clusters.refresh()
+
+    level = house_clusters.get_level(zoom)
+    xs, ys = level.x, level.y
+
+    if raw:
+        xs, ys = to_raw(xs, ys)
+
+    # Clusters are filtered by their centroids
+    mask = np.ones(len(xs), dtype=bool)
+
+    if bbox:
+        mask = (xs >= bbox[0]) & (xs <= bbox[2]) & (ys >= bbox[1]) & (ys <= bbox[3])
+
+    data = [
+        ClusterV1(x=x, y=y, count=count, owned=owned, free=count - owned)
+        for x, y, count, owned in zip(xs[mask].tolist(), ys[mask].tolist(), level.count[mask].tolist(), level.owned[mask].tolist())
+    ]
+
+    return ClustersResponseV1(data=data, zoom=zoom)
+
+
+async def build_house_event(since: int, raw: bool) -> Tuple[int, str]:
+    changes = await query_house_changes(since, raw)
+    return changes["cursor"], f"id: {changes['cursor']}\ndata: {dumps(changes).decode()}\n\n"
+
+
+async def build_house_index(raw: bool) -> HouseIndex:
+    return HouseIndex(await query_houses(raw))
+
+
+async def get_house_index(raw: bool) -> HouseIndex:
+    return await snapshots.get("houses", ("index", raw), lambda: build_house_index(raw))
+
+
+async def build_houses(raw: bool, packed: bool) -> Snapshot:
+    # Snapshot shares houses queried for the index of the same version
+    index = await get_house_index(raw)
+
+    if packed:
+        return Snapshot(pack_houses(index.response), media_type=MSGPACK_MEDIA_TYPE)
+
+    return Snapshot(dumps(index.response))
+
+
+async def build_house_clusters(zoom: int, raw: bool) -> Snapshot:
+    return Snapshot.from_model(await query_house_clusters(zoom, raw))
+
+
+async def build_blips(raw: bool, packed: bool) -> Snapshot:
+    # Map coordinates are stored next to raw ones, so they are just selected under the same names
+    if raw:
+        data = await Blip.all().order_by("id").values("id", "x", "y", "name", "icon")
+    else:
+        data = await Blip.all().order_by("id").values("id", "name", "icon", x="map_x", y="map_y")
+
+    if packed:
+        return Snapshot(pack_blips({"data": data}), media_type=MSGPACK_MEDIA_TYPE)
+
+    return Snapshot(dumps({"data": data}))
+
+
+async def build_events(raw: bool) -> Snapshot:
     events = await Event.filter(Q(end_date__gt=Parameter("NOW()")) | Q(end_date__isnull=True)).order_by("id").prefetch_related("location", "location__root")
     data = []
 
     for event in events:
         if not raw:
-            event.x = 3000 + event.x
-            event.y = 3000 - event.y
+            event.x, event.y = to_map(event.x, event.y)
 
         data.append(EventV1.model_validate(event, from_attributes=True))
 
-    return EventsResponseV1(data=data)
+    # Snapshot has to be rebuilt as soon as the first event ends
+    expires = min([event.end_date.timestamp() for event in events if event.end_date] + [time.time() + EVENTS_MAX_AGE])
+    return Snapshot.from_model(EventsResponseV1(data=data), expires=expires)
 
 
-@router.get("/zones")
-async def get_zones(raw: bool = False) -> ZonesResponseV1:
-    """Get all zones"""
+async def build_zone_geometries(zoom: Optional[int]) -> Tuple[List[Zone], np.ndarray]:
     zones = await Zone.all().order_by("id")
+    geometries = np.array([zone.get_polygon() for zone in zones], dtype=object)
+
+    # Cities overlap zones within them, so they are simplified together with their zones
+    if zoom is not None:
+        indices = {zone.id: index for index, zone in enumerate(zones)}
+        geometries = simplify_zones(geometries, [indices.get(zone.root_id) for zone in zones], get_tolerance(zoom))
+
+    return zones, geometries
+
+
+async def build_zones(raw: bool, zoom: Optional[int], encoding: Optional[str]) -> Snapshot:
+    # Simplified geometries are shared by all variants of the same zoom level
+    zones, geometries = await snapshots.get("zones", ("geometries", zoom), lambda: build_zone_geometries(zoom))
+
+    if not raw:
+        geometries = to_map_geometries(geometries)
+
     data = []
 
-    for zone in zones:
-        if not raw:
-            for i, polygon in enumerate(zone.points):
-                if len(polygon) == 2:
-                    zone.points[i] = (3000 + polygon[0], 3000 - polygon[1])
-                else:
-                    zone.points[i] = [(3000 + point[0], 3000 - point[1]) for point in polygon]
+    for zone, geometry in zip(zones, geometries):
+        if zoom is None and encoding is None:
+            # Points are served as stored by default, while rings of geometries are always closed
+            polygons = [zone.points] if isinstance(geometry, shapely.Polygon) else zone.points
+            rings = [np.array(polygon) for polygon in polygons]
+
+            if not raw:
+                rings = [np.column_stack(to_map(ring[:, 0], ring[:, 1])) for ring in rings]
+        else:
+            rings = [np.rint(shapely.get_coordinates(polygon.exterior)).astype(np.int64) for polygon in shapely.get_parts(geometry)]
+
+        if encoding == "polyline":
+            data.append(EncodedZoneV1(id=zone.id, name=zone.name, description=zone.description, points=[encode_polyline(ring) for ring in rings]))
+        else:
+            points = [ring.tolist() for ring in rings]
+            data.append(ZoneV1(id=zone.id, name=zone.name, description=zone.description, points=points[0] if isinstance(geometry, shapely.Polygon) else points))
+
+    if encoding == "polyline":
+        return Snapshot.from_model(EncodedZonesResponseV1(data=data))
+
+    return Snapshot.from_model(ZonesResponseV1(data=data))
+
+
+@router.get("/houses", response_model=HousesResponseV1, responses=COLUMNAR_RESPONSES)
+async def get_houses(
+    request: Request,
+    raw: bool = False,
+    last_update: Optional[datetime] = None,
+    bbox: Optional[str] = None,
+    after: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=10000)] = 1000,
+) -> Response:
+    """Get all houses, or houses within bounding box given as minx,miny,maxx,maxy"""
+    bounds = parse_bbox(bbox) if bbox else None
+
+    if last_update:
+        return Response(dumps(await query_houses(raw, last_update, bounds, after, limit)), media_type="application/json")
+
+    if bounds:
+        index = await get_house_index(raw)
+        return Response(dumps(index.query(bounds, after, limit)), media_type="application/json")
+
+    packed = accepts_msgpack(request)
+    snapshot = await snapshots.get("houses", (raw, packed), lambda: build_houses(raw, packed), shared=True)
+    return snapshot.to_response(request, vary=("Accept",))
+
+
+@router.get("/houses/clusters", response_model=ClustersResponseV1)
+async def get_house_clusters(
+    request: Request,
+    zoom: Annotated[int, Query(ge=MIN_ZOOM, le=MAX_ZOOM)],
+    raw: bool = False,
+    bbox: Optional[str] = None,
+) -> Response:
+    """Get houses grouped into clusters for given zoom level"""
+    if bbox:
+        return await query_house_clusters(zoom, raw, parse_bbox(bbox))
+
+    snapshot = await snapshots.get("houses", ("clusters", zoom, raw), lambda: build_house_clusters(zoom, raw), shared=True)
+    return snapshot.to_response(request)
+
+
+@router.get("/houses/changes", response_model=HouseChangesResponseV1)
+async def get_house_changes(since: Annotated[int, Query(ge=0)] = 0, raw: bool = False, limit: Annotated[int, Query(ge=1, le=10000)] = 1000) -> Response:
+    """Get houses updated or deleted after given cursor"""
+    return Response(dumps(await query_house_changes(since, raw, limit)), media_type="application/json")
+
+
+@router.get("/houses/stream", response_class=StreamingResponse)
+async def stream_houses(
+    request: Request,
+    raw: bool = False,
+    since: Annotated[Optional[int], Query(ge=0)] = None,
+    last_event_id: Annotated[Optional[int], Header()] = None,
+) -> StreamingResponse:
+    """Stream changes of houses as server-sent events"""
+    # Reconnecting clients continue from the last received event
+    cursor = last_event_id if last_event_id is not None else since
+
+    if cursor is None:
+        cursor = house_broadcaster.cursor
+
+    async def events():
+        nonlocal cursor
+        yield "retry: 5000\n\n"
+
+        while not await request.is_disconnected():
+            if await house_broadcaster.wait(cursor, STREAM_HEARTBEAT) <= cursor:
+                yield ": ping\n\n"
+                continue
+
+            # Clients at the same cursor share a single query
+            start = cursor
+            cursor, event = await house_broadcaster.get_payload((start, raw), lambda: build_house_event(start, raw))
+
+            # No newer changes were found, which happens after change log was recreated, so cursor is read again
+            if cursor <= start:
+                house_broadcaster.discard((start, raw))
+                await house_broadcaster.resync()
+                await asyncio.sleep(STREAM_RETRY_DELAY)
+                continue
+
+            yield event
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"X-Accel-Buffering": "no"})
+
+
+@router.get("/blips", response_model=BlipsResponseV1, responses=COLUMNAR_RESPONSES)
+async def get_blips(request: Request, raw: bool = False) -> Response:
+    """Get all blips"""
+    packed = accepts_msgpack(request)
+    snapshot = await snapshots.get("blips", (raw, packed), lambda: build_blips(raw, packed), shared=True)
+    return snapshot.to_response(request, vary=("Accept",))
+
+
+@router.get("/events", response_model=EventsResponseV1)
+async def get_events(request: Request, raw: bool = False) -> Response:
+    """Get all events"""
+    snapshot = await snapshots.get("events", raw, lambda: build_events(raw), shared=True)
+    return snapshot.to_response(request)
 
-        data.append(ZoneV1.model_validate(zone, from_attributes=True))
 
-    return ZonesResponseV1(data=data)
+@router.get("/zones", response_model=Union[ZonesResponseV1, EncodedZonesResponseV1])
+async def get_zones(
+    request: Request,
+    raw: bool = False,
+    zoom: Annotated[Optional[int], Query(ge=MIN_ZOOM, le=MAX_ZOOM)] = None,
+    encoding: Optional[Literal["polyline"]] = None,
+) -> Response:
+    """Get all zones, optionally simplified for given zoom level or with encoded points"""
+    snapshot = await snapshots.get("zones", (raw, zoom, encoding), lambda: build_zones(raw, zoom, encoding), shared=True)
+    return snapshot.to_response(request)
@@ -0,0 +1,159 @@
+from typing import Annotated, List, Tuple
+
+import numpy as np
+import shapely
+from fastapi import APIRouter, HTTPException, Path, Request, Response
+
+from mapapylife.api.v1.routes.points import get_house_index
+from mapapylife.api.v1.serializers import dumps
+from mapapylife.api.v1.schemas import (
+    HouseTileV1,
+    TilesetV1,
+    TilesetsResponseV1,
+    ZoneTileFeatureV1,
+    ZoneTileV1,
+)
+from mapapylife.cache import Snapshot, SnapshotCache, get_version
+from mapapylife.config import get_settings
+from mapapylife.coords import MAP_SIZE, to_map, to_raw_bbox
+from mapapylife.zones import MAX_ZOOM, MIN_ZOOM, zone_registry
+
+router = APIRouter(prefix="/tiles", tags=["tiles"])
+
+# Every layer has thousands of tiles at the highest zoom levels, only the most requested ones are kept
+snapshots = SnapshotCache(size=get_settings().tile_cache_size)
+
+# Number of integer units along the edge of a tile
+TILE_EXTENT = 4096
+
+# Zones are clipped slightly outside of tiles, so their edges do not show at tile borders
+TILE_BUFFER = 64
+
+# Versioned tiles never change, so they can be cached for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+TileCoords = Annotated[int, Path(ge=0)]
+
+
+def get_tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Get bounds of a tile in map coordinates, map is split into 2^z by 2^z tiles"""
+    if not MIN_ZOOM <= z <= MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+    size = MAP_SIZE / 2 ** z
+    return x * size, y * size, (x + 1) * size, (y + 1) * size
+
+
+def quantize(xs: np.ndarray, ys: np.ndarray, bounds: Tuple[float, float, float, float]) -> np.ndarray:
+    """Convert map coordinates to integer coordinates local to a tile"""
+    scale = TILE_EXTENT / (bounds[2] - bounds[0])
+    return np.rint(np.column_stack([(xs - bounds[0]) * scale, (ys - bounds[1]) * scale])).astype(np.int64)
+
+
+def get_rings(geometry: shapely.Geometry, bounds: Tuple[float, float, float, float]) -> List[List[Tuple[int, int]]]:
+    rings = []
+
+    for polygon in shapely.get_parts(geometry):
+        if not isinstance(polygon, shapely.Polygon) or polygon.is_empty:
+            continue
+
+        coords = shapely.get_coordinates(polygon.exterior)
+        points = quantize(*to_map(coords[:, 0], coords[:, 1]), bounds)
+
+        # Points merged by quantization are dropped, together with rings which collapsed
+        points = points[np.concatenate([[True], np.any(np.diff(points, axis=0) != 0, axis=1)])]
+
+        if len(points) >= 4:
+            rings.append([tuple(point) for point in points.tolist()])
+
+    return rings
+
+
+async def build_zone_tile(z: int, x: int, y: int) -> Snapshot:
+    await zone_registry.refresh()
+
+    bounds = get_tile_bounds(z, x, y)
+    buffer = TILE_BUFFER * (bounds[2] - bounds[0]) / TILE_EXTENT
+
+    # Tile is clipped in raw coordinates, where zone geometries are kept
+    minx, miny, maxx, maxy = to_raw_bbox((bounds[0] - buffer, bounds[1] - buffer, bounds[2] + buffer, bounds[3] + buffer))
+
+    data = []
+
+    for index in np.sort(zone_registry.tree.query(shapely.box(minx, miny, maxx, maxy))).tolist():
+        entry = zone_registry.entries[index]
+        geometry = shapely.clip_by_rect(zone_registry.geometries[index], minx, miny, maxx, maxy)
+        rings = get_rings(geometry, bounds)
+
+        if rings:
+            data.append(ZoneTileFeatureV1(id=entry.id, name=entry.name, points=rings))
+
+    return Snapshot.from_model(ZoneTileV1(data=data, extent=TILE_EXTENT))
+
+
+async def build_house_tile(z: int, x: int, y: int) -> Snapshot:
+    bounds = get_tile_bounds(z, x, y)
+    index = await get_house_index(False)
+
+    # Houses on the edge between tiles belong to the one on the right or below
+    houses = [
+        house for house in index.query(bounds, limit=len(index.response["data"]))["data"]
+        if house["x"] < bounds[2] and house["y"] < bounds[3]
+    ]
+
+    points = quantize(
+        np.array([house["x"] for house in houses], dtype=np.float64),
+        np.array([house["y"] for house in houses], dtype=np.float64),
+        bounds,
+    )
+
+    # Tile features follow the shape of HouseTileV1
+    data = [{**house, "x": point[0], "y": point[1]} for house, point in zip(houses, points.tolist())]
+    return Snapshot(dumps({"data": data, "extent": TILE_EXTENT}))
+
+
+def get_tile_response(request: Request, snapshot: Snapshot, version: int, requested: int) -> Response:
+    response = snapshot.to_response(request)
+
+    # Only tiles requested for the current version are immutable, anything else has to be revalidated.
+    # Version 0 is only assumed while Redis is not reachable, so it is never trusted.
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if version and requested == version else "no-cache"
+    return response
+
+
+@router.get("/")
+async def get_tilesets(request: Request) -> TilesetsResponseV1:
+    """Get tile layers with URLs of their current versions"""
+    data = []
+
+    for layer in ("zones", "houses"):
+        version = await get_version(layer)
+
+        data.append(TilesetV1(
+            layer=layer,
+            version=version,
+            url=f"{request.url.path.rstrip('/')}/{layer}/{{z}}/{{x}}/{{y}}?v={version}",
+            min_zoom=MIN_ZOOM,
+            max_zoom=MAX_ZOOM,
+            extent=TILE_EXTENT,
+        ))
+
+    return TilesetsResponseV1(data=data)
+
+
+@router.get("/zones/{z}/{x}/{y}", response_model=ZoneTileV1)
+async def get_zone_tile(request: Request, z: TileCoords, x: TileCoords, y: TileCoords, v: int = -1) -> Response:
+    """Get zones clipped to a tile"""
+    get_tile_bounds(z, x, y)
+    version = await get_version("zones")
+    snapshot = await snapshots.get("zones", (z, x, y), lambda: build_zone_tile(z, x, y))
+    return get_tile_response(request, snapshot, version, v)
+
+
+@router.get("/houses/{z}/{x}/{y}", response_model=HouseTileV1)
+async def get_house_tile(request: Request, z: TileCoords, x: TileCoords, y: TileCoords, v: int = -1) -> Response:
+    """Get houses within a tile"""
+    get_tile_bounds(z, x, y)
+    version = await get_version("houses")
+    snapshot = await snapshots.get("houses", (z, x, y), lambda: build_house_tile(z, x, y))
+    return get_tile_response(request, snapshot, version, v)
@@ -1,7 +1,6 @@
 from datetime import datetime
 from decimal import Decimal
-from typing import Any, List, Optional, Tuple, Union
-from typing_extensions import Self
+from typing import List, Optional, Tuple, Union
 
 from pydantic import field_validator, ConfigDict, BaseModel, Field
 from pydantic.networks import HttpUrl
@@ -54,6 +53,63 @@ class HouseV1(BaseModel):
 class HousesResponseV1(BaseModel):
     data: List[HouseV1]
     last_update: Optional[datetime] = None
+    cursor: Optional[int] = None
+    has_more: bool = False
+
+
+class ZoneTileFeatureV1(BaseModel):
+    id: int
+    name: str
+    points: MultiPolygon
+
+
+class ZoneTileV1(BaseModel):
+    data: List[ZoneTileFeatureV1]
+    extent: int
+
+
+class HouseTileFeatureV1(HouseV1):
+    x: int
+    y: int
+
+
+class HouseTileV1(BaseModel):
+    data: List[HouseTileFeatureV1]
+    extent: int
+
+
+class TilesetV1(BaseModel):
+    layer: str
+    version: int
+    url: str
+    min_zoom: int
+    max_zoom: int
+    extent: int
+
+
+class TilesetsResponseV1(BaseModel):
+    data: List[TilesetV1]
+
+
+class ClusterV1(BaseModel):
+    x: float
+    y: float
+    count: int
+    owned: int
+    free: int
+
+
+class ClustersResponseV1(BaseModel):
+    data: List[ClusterV1]
+    zoom: int
+
+
+class HouseChangesResponseV1(BaseModel):
+    data: List[HouseV1]
+    deleted: List[int]
+    cursor: int
+    has_more: bool
+    resync: bool = False
 
 
 class BlipV1(BaseModel):
@@ -95,15 +151,29 @@ class ZonesResponseV1(BaseModel):
     data: List[ZoneV1]
 
 
+class EncodedZoneV1(BaseModel):
+    id: int
+    name: str
+    description: str
+    points: List[str]
+
+
+class EncodedZonesResponseV1(BaseModel):
+    data: List[EncodedZoneV1]
+
+
 class LookupResultV1(BaseModel):
     zone_name: Optional[str] = None
     city_name: Optional[str] = None
 
-    @classmethod
-    def model_validate(cls, obj: Any, *, strict: bool | None = None, from_attributes: bool | None = None, context: Any | None = None) -> Self:
-        obj.zone_name = obj.name if obj.root else None
-        obj.city_name = obj.root.name if obj.root else obj.name
-        return super().model_validate(obj, strict=strict, from_attributes=from_attributes, context=context)
+
+class LookupBatchRequestV1(BaseModel):
+    points: List[Tuple[float, float]] = Field(max_length=10000)
+    raw: bool = False
+
+
+class LookupBatchResponseV1(BaseModel):
+    data: List[Optional[LookupResultV1]]
 
 
 class SearchResultV1(BaseModel):
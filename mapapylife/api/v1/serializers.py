@@ -0,0 +1,74 @@
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from pydantic import HttpUrl, TypeAdapter, ValidationError
+
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+    import json
+
+# Validates URLs like HttpUrl fields of response models
+URL_ADAPTER = TypeAdapter(HttpUrl)
+
+
+def encode_value(value: Any) -> Any:
+    # Values are written the same way as by Pydantic
+    if isinstance(value, datetime):
+        return value.isoformat().replace("+00:00", "Z")
+
+    if isinstance(value, Decimal):
+        return str(value)
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize plain objects to JSON, without validating them with Pydantic"""
+    if rapidjson:
+        return rapidjson.dumps(obj, default=encode_value, ensure_ascii=False).encode()
+
+    return json.dumps(obj, default=encode_value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+@lru_cache(maxsize=4096)
+def normalize_url(url: Optional[str]) -> Optional[str]:
+    # URLs are written the same way as by HttpUrl fields of Pydantic, every distinct URL is validated once
+    if not url:
+        return None
+
+    try:
+        return str(URL_ADAPTER.validate_python(url))
+    except ValidationError:
+        return None
+
+
+def serialize_house(row: Dict[str, Any], raw: bool) -> Dict[str, Any]:
+    """Convert flat row of house to the shape of HouseV1"""
+    return {
+        "id": row["id"],
+        "x": row["x"] if raw else row["map_x"],
+        "y": row["y"] if raw else row["map_y"],
+        "title": row["title"],
+        "location": {
+            "id": row["location_id"],
+            "name": row["location__name"],
+            "root_name": row["location__root__name"],
+        } if row["location_id"] is not None else None,
+        "owner": {
+            "id": row["owner_id"],
+            "name": row["owner__login"],
+            "premium": row["owner__premium"],
+        } if row["owner_id"] is not None else None,
+        "organization": {
+            "id": row["organization_id"],
+            "name": row["organization__name"],
+            "logo_url": normalize_url(row["organization__logo_url"]),
+        } if row["organization_id"] is not None else None,
+        "price": row["price"],
+        "expires": row["expires"],
+        "last_update": row["last_update"],
+    }
@@ -0,0 +1,464 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from mapapylife.config import get_settings
+from mapapylife.db import get_replay_position, get_write_position, has_replica, read_from_primary
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "mapapylife:version:{}"
+HOUSES_CHANNEL = "mapapylife:houses"
+POSITION_KEY = "mapapylife:position"
+SHARED_KEY = "mapapylife:shared:{}"
+LOCK_KEY = "mapapylife:lock:{}"
+
+# Shared results only need to outlive a burst of requests, every version has its own keys anyway
+SHARED_TTL = 30
+
+# Default quality 11 takes seconds for large datasets on the event loop, quality 5 is about as fast as gzip
+BROTLI_QUALITY = 5
+
+# Lock outlives any reasonable rebuild, in case its holder dies before releasing it
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+# Lock is only released by its holder, it may have expired and been taken by another process
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Position only moves forward, when jobs publish their changes in a different order than they committed them
+POSITION_SCRIPT = """
+if tonumber(ARGV[1]) > tonumber(redis.call("GET", KEYS[1]) or "-1") then
+    redis.call("SET", KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# Events are managed outside of the worker and never bump versions, so data built from them is refreshed periodically
+EVENTS_MAX_AGE = 300
+
+# Versions last read from Redis, so objects cached in process are still served while it is not reachable
+known_versions: Dict[str, int] = {}
+
+
+@lru_cache()
+def get_redis() -> aioredis.Redis:
+    settings = get_settings()
+    return aioredis.from_url(settings.redis_url, encoding="utf8", decode_responses=True)
+
+
+@lru_cache()
+def get_binary_redis() -> aioredis.Redis:
+    # Shared results contain compressed bodies, so they are not decoded
+    settings = get_settings()
+    return aioredis.from_url(settings.redis_url)
+
+
+def get_version_epoch() -> int:
+    # Versions start from current time in milliseconds, so they are not reused after Redis loses its data
+    return time.time_ns() // 1_000_000
+
+
+def get_events_epoch() -> int:
+    """Get number of the current period of events, the same in all processes"""
+    return int(time.time() // EVENTS_MAX_AGE)
+
+
+async def get_version(dataset: str) -> int:
+    """Get current version of dataset, bumped every time its tables change"""
+    redis = get_redis()
+
+    try:
+        version = await redis.get(VERSION_KEY.format(dataset))
+
+        if version is None:
+            await redis.set(VERSION_KEY.format(dataset), get_version_epoch(), nx=True)
+            version = await redis.get(VERSION_KEY.format(dataset))
+    except RedisError as e:
+        logger.warning(f'Could not read version of "{dataset}" from Redis, assuming it is unchanged: {e!r}')
+        return known_versions.get(dataset, 0)
+
+    known_versions[dataset] = int(version or 0)
+    return known_versions[dataset]
+
+
+async def bump_versions(*datasets: str):
+    # Replica is read once it replayed the log up to position of changes published with these versions
+    position = await get_write_position()
+
+    async with get_redis().pipeline(transaction=True) as pipe:
+        for dataset in datasets:
+            pipe.set(VERSION_KEY.format(dataset), get_version_epoch(), nx=True)
+            pipe.incr(VERSION_KEY.format(dataset))
+
+        if position is not None:
+            pipe.eval(POSITION_SCRIPT, 1, POSITION_KEY, position)
+
+        await pipe.execute()
+
+
+class ReplicaMonitor:
+    """Tells if replica has replayed every change published with current versions"""
+
+    def __init__(self):
+        # Position replayed by the replica, as last seen by this process
+        self.position = -1
+
+    async def is_current(self) -> bool:
+        if not has_replica():
+            return True
+
+        try:
+            published = await get_redis().get(POSITION_KEY)
+        except RedisError as e:
+            logger.warning(f"Could not read published position from Redis, reading from primary: {e!r}")
+            return False
+
+        if published is None or int(published) <= self.position:
+            return True
+
+        position = await get_replay_position()
+
+        # Read connection is not a standby, so there is no lag
+        if position is None:
+            return True
+
+        self.position = max(self.position, position)
+        return int(published) <= position
+
+
+replica_monitor = ReplicaMonitor()
+
+
+@asynccontextmanager
+async def read_consistently() -> AsyncIterator[None]:
+    """Read from the replica, or from the primary while the replica lags behind published changes"""
+    if await replica_monitor.is_current():
+        yield
+        return
+
+    # Objects are cached until the next version bump, so they cannot be built from stale data
+    with read_from_primary():
+        yield
+
+
+async def build_consistently(build: Callable[[], Awaitable[Any]]) -> Any:
+    async with read_consistently():
+        return await build()
+
+
+def parse_etags(header: Optional[str]) -> set:
+    if not header:
+        return set()
+
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+def parse_http_date(header: Optional[str]) -> Optional[datetime]:
+    if not header:
+        return None
+
+    try:
+        return parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_accept(header: Optional[str]) -> set:
+    """Parse values of Accept or Accept-Encoding header"""
+    if not header:
+        return set()
+
+    values = set()
+
+    for item in header.split(","):
+        value, *params = item.split(";")
+        quality = 1.0
+
+        for param in params:
+            name, _, value = param.strip().partition("=")
+
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        # Skip values explicitly refused by client
+        if quality > 0:
+            values.add(value.strip().lower())
+
+    return values
+
+
+class Snapshot:
+    """Pre-serialized response body with its compressed variants"""
+
+    def __init__(
+        self,
+        body: bytes,
+        media_type: str = "application/json",
+        expires: Optional[float] = None,
+        last_modified: Optional[datetime] = None,
+        encodings: Optional[Dict[str, bytes]] = None,
+    ):
+        self.body = body
+        self.media_type = media_type
+        self.expires = expires
+        self.last_modified = last_modified.replace(microsecond=0) if last_modified else None
+        self.version = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+        # Snapshots restored from Redis were already compressed by the process which built them
+        if encodings is not None:
+            self.encodings = encodings
+            return
+
+        self.encodings = {"gzip": gzip.compress(body, compresslevel=6)}
+
+        if brotli:
+            self.encodings["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+    @classmethod
+    def from_model(cls, model: BaseModel, **kwargs) -> "Snapshot":
+        return cls(model.model_dump_json(by_alias=True).encode(), **kwargs)
+
+    def dump(self) -> Dict[str, bytes]:
+        """Convert snapshot to fields of Redis hash"""
+        fields = {"body": self.body, "media_type": self.media_type.encode()}
+        fields.update((f"encoding:{name}", value) for name, value in self.encodings.items())
+
+        if self.expires:
+            fields["expires"] = repr(self.expires).encode()
+
+        if self.last_modified:
+            fields["last_modified"] = self.last_modified.isoformat().encode()
+
+        return fields
+
+    @classmethod
+    def load(cls, fields: Dict[bytes, bytes]) -> "Snapshot":
+        """Restore snapshot from fields of Redis hash"""
+        fields = {name.decode(): value for name, value in fields.items()}
+        last_modified = fields.get("last_modified")
+
+        return cls(
+            fields["body"],
+            media_type=fields["media_type"].decode(),
+            expires=float(fields["expires"]) if "expires" in fields else None,
+            last_modified=datetime.fromisoformat(last_modified.decode()) if last_modified else None,
+            encodings={name.removeprefix("encoding:"): value for name, value in fields.items() if name.startswith("encoding:")},
+        )
+
+    def get_etag(self, encoding: Optional[str] = None) -> str:
+        # Every encoding is a different representation, so it needs its own strong validator
+        return f'"{self.version}-{encoding}"' if encoding else f'"{self.version}"'
+
+    def to_response(self, request: Request, vary: Tuple[str, ...] = ()) -> Response:
+        accepted = parse_accept(request.headers.get("Accept-Encoding"))
+        encoding = next((encoding for encoding in ("br", "gzip") if encoding in self.encodings and encoding in accepted), None)
+
+        headers = {
+            "ETag": self.get_etag(encoding),
+            "Vary": ", ".join((*vary, "Accept-Encoding")),
+        }
+
+        if self.last_modified:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+
+        # Client already has this snapshot in any of its encodings
+        etags = parse_etags(request.headers.get("If-None-Match"))
+
+        if "*" in etags or etags & {self.get_etag(name) for name in (None, *self.encodings)}:
+            return Response(status_code=304, headers=headers)
+
+        # Dates are only compared when client did not send any ETag, as ETag is the stronger validator
+        modified_since = parse_http_date(request.headers.get("If-Modified-Since")) if not etags else None
+
+        if self.last_modified and modified_since and self.last_modified <= modified_since:
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(self.encodings[encoding], media_type=self.media_type, headers=headers)
+
+        return Response(self.body, media_type=self.media_type, headers=headers)
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight build"""
+
+    def __init__(self):
+        self.futures: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, build: Callable[[], Awaitable[Any]]) -> Any:
+        future = self.futures.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(build())
+            future.add_done_callback(lambda _: self.futures.pop(key, None))
+            self.futures[key] = future
+
+        # Build keeps running for the other callers if one of them is cancelled
+        return await asyncio.shield(future)
+
+
+def get_shared_name(*parts: Hashable) -> str:
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+async def wait_shared(redis: aioredis.Redis, name: str) -> Optional[Dict[bytes, bytes]]:
+    """Wait until another process stores the result or gives up on building it"""
+    deadline = time.monotonic() + LOCK_TIMEOUT
+
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(SHARED_KEY.format(name))
+            pipe.exists(LOCK_KEY.format(name))
+            fields, locked = await pipe.execute()
+
+        if fields or not locked:
+            return fields or None
+
+    return None
+
+
+async def store_shared(redis: aioredis.Redis, name: str, value: Any, dump: Callable[[Any], Dict[str, bytes]]):
+    # Results which expire sooner are not shared for longer than they are valid
+    expires = getattr(value, "expires", None)
+    ttl = min(SHARED_TTL, expires - time.time()) if expires else SHARED_TTL
+
+    if ttl <= 0:
+        return
+
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(SHARED_KEY.format(name), mapping=dump(value))
+            pipe.pexpire(SHARED_KEY.format(name), max(1, int(ttl * 1000)))
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Could not store shared result in Redis: {e!r}")
+
+
+async def build_shared(
+    name: str,
+    build: Callable[[], Awaitable[Any]],
+    dump: Callable[[Any], Dict[str, bytes]],
+    load: Callable[[Dict[bytes, bytes]], Any],
+) -> Any:
+    """Build result in one process at a time, the others read it from Redis once it is stored"""
+    redis = get_binary_redis()
+    token = secrets.token_hex(16)
+    locked = False
+
+    try:
+        fields = await redis.hgetall(SHARED_KEY.format(name))
+
+        if not fields:
+            locked = bool(await redis.set(LOCK_KEY.format(name), token, nx=True, px=LOCK_TIMEOUT * 1000))
+
+            if not locked:
+                fields = await wait_shared(redis, name)
+    except RedisError as e:
+        # Results are never blocked by Redis, every process builds its own until it is reachable again
+        logger.warning(f"Could not read shared result from Redis: {e!r}")
+        return await build()
+
+    if fields:
+        return load(fields)
+
+    try:
+        value = await build()
+
+        if locked and value is not None:
+            await store_shared(redis, name, value, dump)
+    finally:
+        if locked:
+            try:
+                await redis.eval(RELEASE_SCRIPT, 1, LOCK_KEY.format(name), token)
+            except RedisError as e:
+                logger.warning(f"Could not release lock in Redis: {e!r}")
+
+    return value
+
+
+class SnapshotCache:
+    """In-process cache of objects built from a dataset, valid until the dataset version changes"""
+
+    def __init__(self, size: Optional[int] = None):
+        # Least recently used entries are evicted above size, if given
+        self.size = size
+        self.entries: "OrderedDict[Hashable, Tuple[Hashable, Any]]" = OrderedDict()
+        self.flights = SingleFlight()
+
+    async def get(self, dataset: str, key: Hashable, build: Callable[[], Awaitable[Any]], shared: bool = False) -> Any:
+        """Get cached object or build it, shared snapshots are built by only one process at a time"""
+        version = await get_version(dataset)
+        return await self.get_validated((dataset, key), version, build, shared, ordered=True)
+
+    async def get_validated(
+        self,
+        key: Hashable,
+        validator: Hashable,
+        build: Callable[[], Awaitable[Any]],
+        shared: bool = False,
+        ordered: bool = False,
+    ) -> Any:
+        """Get cached object or build it again, if it was built for another validator.
+
+        Ordered validators are versions, objects built for older ones never replace those built for newer ones.
+        """
+        entry = self.entries.get(key)
+
+        if entry and entry[0] == validator:
+            expires = getattr(entry[1], "expires", None)
+
+            if not expires or expires > time.time():
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        if shared:
+            name = get_shared_name(key, validator)
+            value = await self.flights.run((key, validator), lambda: build_shared(name, lambda: build_consistently(build), Snapshot.dump, Snapshot.load))
+        else:
+            value = await self.flights.run((key, validator), lambda: build_consistently(build))
+
+        # Build for a newer version may have finished while this one was running
+        entry = self.entries.get(key)
+
+        if ordered and entry and entry[0] > validator:
+            return value
+
+        self.entries[key] = (validator, value)
+        self.entries.move_to_end(key)
+
+        if self.size is not None:
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        return value
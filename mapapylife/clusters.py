@@ -0,0 +1,140 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from mapapylife.cache import get_version, read_consistently
+from mapapylife.coords import MAP_SIZE
+from mapapylife.models import ChangeAction, House, HouseChange
+from mapapylife.zones import MAX_ZOOM, MIN_ZOOM
+
+# Size of cluster cell in pixels, on 256 pixel wide map at zoom level 0
+CLUSTER_RADIUS = 64
+
+
+@dataclass
+class ClusterLevel:
+    """Houses grouped into cells of grid at single zoom level"""
+
+    size: int
+    cells: np.ndarray
+    count: np.ndarray
+    owned: np.ndarray
+    sum_x: np.ndarray
+    sum_y: np.ndarray
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.sum_x / self.count
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.sum_y / self.count
+
+    def merge(self) -> "ClusterLevel":
+        """Get the next coarser level, every cell is merged with its three neighbours"""
+        size = self.size // 2
+        rows, columns = np.divmod(self.cells, self.size)
+        cells, inverse = np.unique((rows // 2) * size + columns // 2, return_inverse=True)
+
+        return ClusterLevel(
+            size=size,
+            cells=cells,
+            count=np.bincount(inverse, weights=self.count, minlength=len(cells)).astype(np.int64),
+            owned=np.bincount(inverse, weights=self.owned, minlength=len(cells)).astype(np.int64),
+            sum_x=np.bincount(inverse, weights=self.sum_x, minlength=len(cells)),
+            sum_y=np.bincount(inverse, weights=self.sum_y, minlength=len(cells)),
+        )
+
+
+class HouseClusters:
+    """Process-wide hierarchical grid of houses, caught up from change log when houses change"""
+
+    def __init__(self):
+        self.houses: Dict[int, Tuple[float, float, bool]] = {}
+        self.levels: List[ClusterLevel] = []
+        self.cursor: Optional[int] = None
+        self.version: Optional[int] = None
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def build_levels(houses: Dict[int, Tuple[float, float, bool]]) -> List[ClusterLevel]:
+        """Build grids of all zoom levels in map coordinates, starting from the finest one"""
+        positions = np.array(list(houses.values()), dtype=np.float64).reshape(-1, 3)
+        xs, ys, owned = positions[:, 0], positions[:, 1], positions[:, 2]
+
+        size = 256 // CLUSTER_RADIUS * 2 ** MAX_ZOOM
+        columns = np.clip((xs * size // MAP_SIZE).astype(np.int64), 0, size - 1)
+        rows = np.clip((ys * size // MAP_SIZE).astype(np.int64), 0, size - 1)
+        cells, inverse = np.unique(rows * size + columns, return_inverse=True)
+
+        level = ClusterLevel(
+            size=size,
+            cells=cells,
+            count=np.bincount(inverse, minlength=len(cells)).astype(np.int64),
+            owned=np.bincount(inverse, weights=owned, minlength=len(cells)).astype(np.int64),
+            sum_x=np.bincount(inverse, weights=xs, minlength=len(cells)),
+            sum_y=np.bincount(inverse, weights=ys, minlength=len(cells)),
+        )
+
+        levels = [level]
+
+        for _ in range(MIN_ZOOM, MAX_ZOOM):
+            levels.insert(0, levels[0].merge())
+
+        return levels
+
+    async def load(self):
+        # Cursor is read first, so changes made in the meantime are replayed later
+        cursor = await HouseChange.get_cursor()
+        rows = await House.all().values_list("id", "map_x", "map_y", "owner_id")
+
+        self.houses = {house_id: (x, y, owner_id is not None) for house_id, x, y, owner_id in rows}
+        self.cursor = cursor
+
+    async def catch_up(self):
+        changes = await HouseChange.filter(id__gt=self.cursor).order_by("id").values_list("id", "house_id", "action")
+
+        if not changes:
+            return
+
+        # Only the latest action of every house matters
+        actions = {house_id: action for _, house_id, action in changes}
+        upserted = [house_id for house_id, action in actions.items() if action == ChangeAction.UPSERT]
+
+        for house_id, action in actions.items():
+            if action == ChangeAction.DELETE:
+                self.houses.pop(house_id, None)
+
+        if upserted:
+            rows = await House.filter(id__in=upserted).values_list("id", "map_x", "map_y", "owner_id")
+            self.houses.update({house_id: (x, y, owner_id is not None) for house_id, x, y, owner_id in rows})
+
+        self.cursor = changes[-1][0]
+
+    async def refresh(self):
+        """Bring clusters up to date with the current version of houses"""
+        version = await get_version("houses")
+
+        if version == self.version:
+            return
+
+        async with self.lock, read_consistently():
+            if version == self.version:
+                return
+
+            # Everything is loaded again, if change log was recreated together with houses or pruned past the cursor
+            if self.cursor is None or await HouseChange.get_cursor() < self.cursor or await HouseChange.is_pruned(self.cursor):
+                await self.load()
+            else:
+                await self.catch_up()
+
+            self.levels = self.build_levels(self.houses)
+            self.version = version
+
+    def get_level(self, zoom: int) -> ClusterLevel:
+        return self.levels[min(max(zoom, MIN_ZOOM), MAX_ZOOM) - MIN_ZOOM]
+
+
+house_clusters = HouseClusters()
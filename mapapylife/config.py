@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import Optional
+from typing import Dict, Literal, Optional
 
 from pydantic_settings import BaseSettings
 
@@ -7,8 +7,31 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     debug: bool = False
     db_url: str = "sqlite:///db.sqlite3"
+    db_read_url: Optional[str] = None
+    db_pool_min_size: int = 1
+    db_pool_max_size: int = 5
+    db_statement_cache_size: int = 100
+    db_command_timeout: Optional[float] = None
     redis_url: str = "redis://localhost:6379/"
     auth_token: Optional[str] = None
+    zone_raster_dir: Optional[str] = None
+    zone_raster_resolution: int = 10
+    search_backend: Optional[Literal["postgres", "memory"]] = None
+    search_cache_size: int = 1024
+    widget_cache_size: int = 1024
+    tile_cache_size: int = 4096
+    rate_limits: Dict[str, int] = {}
+    rate_limit_sync_interval: float = 1.0
+    rate_limit_timeout: float = 0.1
+    worker_concurrency: int = 8
+    worker_retries: int = 3
+    worker_retry_delay: float = 1.0
+    worker_houses_interval: int = 60
+    worker_players_interval: int = 3600
+    worker_organizations_interval: int = 3600
+    worker_prune_interval: int = 3600
+    house_changes_max_age: int = 7 * 24 * 3600
+    worker_state_max_age: int = 3600
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,35 @@
+from typing import Tuple, TypeVar
+
+import numpy as np
+import shapely
+
+# Raw coordinates of San Andreas span from -3000 to 3000 on both axes
+MAP_SIZE = 6000
+MAP_OFFSET = 3000
+
+# Single coordinates and NumPy arrays are converted the same way
+Coordinate = TypeVar("Coordinate", float, np.ndarray)
+
+BBox = Tuple[float, float, float, float]
+
+
+def to_map(x: Coordinate, y: Coordinate) -> Tuple[Coordinate, Coordinate]:
+    """Convert raw coordinates to map coordinates, starting in the top left corner of the map image"""
+    return MAP_OFFSET + x, MAP_OFFSET - y
+
+
+def to_raw(x: Coordinate, y: Coordinate) -> Tuple[Coordinate, Coordinate]:
+    """Convert map coordinates back to raw coordinates"""
+    return x - MAP_OFFSET, MAP_OFFSET - y
+
+
+def to_raw_bbox(bbox: BBox) -> BBox:
+    # Y axis is flipped, so the top of the box becomes its bottom
+    minx, miny = to_raw(bbox[0], bbox[3])
+    maxx, maxy = to_raw(bbox[2], bbox[1])
+    return minx, miny, maxx, maxy
+
+
+def to_map_geometries(geometries: np.ndarray) -> np.ndarray:
+    """Convert raw coordinates of geometries to map coordinates, in one pass over all of them"""
+    return shapely.transform(geometries, lambda coords: np.column_stack(to_map(coords[:, 0], coords[:, 1])))
@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Type
+
+from tortoise import BaseDBAsyncClient, Model, connections
+from tortoise.backends.base.config_generator import expand_db_url
+
+from mapapylife.config import get_settings
+
+READ_CONNECTION = "read"
+POOL_ENGINES = ("tortoise.backends.asyncpg",)
+
+# Reads of the current context go to the primary, while the replica has not caught up with published changes
+primary_reads: ContextVar[bool] = ContextVar("primary_reads", default=False)
+
+
+class ReadReplicaRouter:
+    """Send reads to read connection and writes to the primary one"""
+
+    def db_for_read(self, model: Type[Model]) -> str:
+        return "default" if primary_reads.get() else READ_CONNECTION
+
+    def db_for_write(self, model: Type[Model]) -> str:
+        return "default"
+
+
+@contextmanager
+def read_from_primary() -> Iterator[None]:
+    """Route reads to the primary, including tasks started inside the block"""
+    token = primary_reads.set(True)
+
+    try:
+        yield
+    finally:
+        primary_reads.reset(token)
+
+
+def has_replica() -> bool:
+    return READ_CONNECTION in connections.db_config
+
+
+def get_read_connection() -> BaseDBAsyncClient:
+    """Get connection for raw read queries, replica is used only if configured"""
+    if primary_reads.get() or not has_replica():
+        return connections.get("default")
+
+    return connections.get(READ_CONNECTION)
+
+
+async def get_write_position() -> Optional[int]:
+    """Get position in write-ahead log of the primary, None if database is not replicated"""
+    connection = connections.get("default")
+
+    if connection.capabilities.dialect != "postgres":
+        return None
+
+    rows = await connection.execute_query_dict("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')::bigint AS position")
+    return rows[0]["position"]
+
+
+async def get_replay_position() -> Optional[int]:
+    """Get position in write-ahead log replayed by the replica, None if read connection is not a standby"""
+    connection = connections.get(READ_CONNECTION)
+
+    if connection.capabilities.dialect != "postgres":
+        return None
+
+    rows = await connection.execute_query_dict("SELECT pg_wal_lsn_diff(pg_last_wal_replay_lsn(), '0/0')::bigint AS position")
+    return rows[0]["position"]
+
+
+def get_connection_config(db_url: str) -> Dict[str, Any]:
+    settings = get_settings()
+    config = expand_db_url(db_url)
+
+    # Pool is only tuned for asyncpg, options given in URL take precedence
+    if config["engine"] in POOL_ENGINES:
+        credentials = config["credentials"]
+        credentials.setdefault("minsize", settings.db_pool_min_size)
+        credentials.setdefault("maxsize", settings.db_pool_max_size)
+        credentials.setdefault("statement_cache_size", settings.db_statement_cache_size)
+
+        if settings.db_command_timeout is not None:
+            credentials.setdefault("command_timeout", settings.db_command_timeout)
+
+    return config
+
+
+def get_tortoise_config(replica: bool = True) -> Dict[str, Any]:
+    """Get configuration of Tortoise, reads go to replica if it is configured and allowed"""
+    settings = get_settings()
+
+    config: Dict[str, Any] = {
+        "connections": {"default": get_connection_config(settings.db_url)},
+        "apps": {"models": {"models": ["mapapylife.models"], "default_connection": "default"}},
+    }
+
+    if replica and settings.db_read_url:
+        config["connections"][READ_CONNECTION] = get_connection_config(settings.db_read_url)
+        config["routers"] = [ReadReplicaRouter]
+
+    return config
+
+
+def get_pool_metrics() -> List[str]:
+    """Get usage of connection pools in Prometheus text format"""
+    gauges = {
+        "size": "Number of open connections",
+        "idle": "Number of idle connections",
+        "used": "Number of connections in use",
+        "max_size": "Maximum number of connections",
+        "saturation": "Share of maximum number of connections in use",
+    }
+
+    values: Dict[str, List[str]] = {name: [] for name in gauges}
+
+    for name in connections.db_config:
+        pool = getattr(connections.get(name), "_pool", None)
+
+        # Only asyncpg pools can be inspected, and only once they are created
+        if pool is None or not hasattr(pool, "get_idle_size"):
+            continue
+
+        size, idle, max_size = pool.get_size(), pool.get_idle_size(), pool.get_max_size()
+        labels = f'{{connection="{name}"}}'
+
+        values["size"].append(f"mapapylife_db_pool_size{labels} {size}")
+        values["idle"].append(f"mapapylife_db_pool_idle{labels} {idle}")
+        values["used"].append(f"mapapylife_db_pool_used{labels} {size - idle}")
+        values["max_size"].append(f"mapapylife_db_pool_max_size{labels} {max_size}")
+        values["saturation"].append(f"mapapylife_db_pool_saturation{labels} {(size - idle) / max_size:.4f}")
+
+    lines = []
+
+    for name, description in gauges.items():
+        lines.append(f"# HELP mapapylife_db_pool_{name} {description}")
+        lines.append(f"# TYPE mapapylife_db_pool_{name} gauge")
+        lines.extend(values[name])
+
+    return lines
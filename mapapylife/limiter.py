@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from redis.commands.core import AsyncScript
+from redis.exceptions import RedisError
+
+from mapapylife.cache import get_redis
+from mapapylife.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY = "mapapylife:ratelimit:{}"
+
+# Consumes tokens from shared bucket and returns the ones left, clock of Redis is shared by all processes
+BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local consumed = tonumber(ARGV[3])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate) - consumed
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(tokens)
+"""
+
+
+async def limiter_identifier(request: Request) -> str:
+    forwarded = request.headers.get("X-Forwarded-For")
+
+    if forwarded:
+        ip_address = forwarded.split(",")[0]
+    else:
+        ip_address = request.client.host
+
+    return ip_address
+
+
+@lru_cache()
+def get_bucket_script() -> AsyncScript:
+    return get_redis().register_script(BUCKET_SCRIPT)
+
+
+@dataclass
+class TokenBucket:
+    capacity: int
+    rate: float
+    tokens: float
+    updated: float
+    last_hit: float
+    pending: int = 0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimitStore:
+    """Token buckets of clients kept in this process, reconciled with buckets shared in Redis in batches"""
+
+    def __init__(self):
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def reconcile(self, items: List[Tuple[str, TokenBucket]]):
+        settings = get_settings()
+        script = get_bucket_script()
+        sent = [bucket.pending for _, bucket in items]
+
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for (key, bucket), consumed in zip(items, sent):
+                    await script(keys=[RATE_LIMIT_KEY.format(key)], args=[bucket.capacity, bucket.rate, consumed], client=pipe)
+
+                results = await asyncio.wait_for(pipe.execute(), settings.rate_limit_timeout)
+        except (RedisError, asyncio.TimeoutError) as e:
+            # Requests are never blocked by Redis, local buckets keep limiting until it is reachable again
+            logger.warning(f"Could not synchronize rate limits with Redis: {e!r}")
+            return
+
+        now = time.monotonic()
+
+        for (_, bucket), consumed, tokens in zip(items, sent, results):
+            # Hits admitted while waiting for Redis are not counted there yet
+            bucket.pending -= consumed
+            bucket.tokens = float(tokens) - bucket.pending
+            bucket.updated = now
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(get_settings().rate_limit_sync_interval)
+            now = time.monotonic()
+
+            # Buckets are dropped once they stay idle for their whole period, so they are the same as new ones
+            for key, bucket in list(self.buckets.items()):
+                bucket.refill(now)
+
+                if not bucket.pending and bucket.tokens >= bucket.capacity and now - bucket.last_hit >= bucket.capacity / bucket.rate:
+                    del self.buckets[key]
+
+            if self.buckets:
+                await self.reconcile(list(self.buckets.items()))
+
+    def hit(self, key: str, times: int, seconds: int) -> int:
+        """Take a token from bucket of the key, returns number of seconds to wait if there is none left"""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+
+        # New buckets start full and are reconciled with Redis in the next batch, requests never wait for it
+        if bucket is None:
+            bucket = TokenBucket(capacity=times, rate=times / seconds, tokens=times, updated=now, last_hit=now)
+            self.buckets[key] = bucket
+
+        bucket.refill(now)
+        bucket.last_hit = now
+
+        if bucket.tokens < 1:
+            return math.ceil((1 - bucket.tokens) / bucket.rate)
+
+        bucket.tokens -= 1
+
+        # Hits are counted at most for one whole bucket, so an outage of Redis cannot lock clients out after it
+        bucket.pending = min(bucket.pending + 1, bucket.capacity)
+
+        return 0
+
+
+rate_limit_store = RateLimitStore()
+
+
+class RateLimiter:
+    """Limit number of requests of every client to a route, limit can be overridden in settings by its name"""
+
+    def __init__(self, name: str, times: int, seconds: int = 60):
+        self.name = name
+        self.times = times
+        self.seconds = seconds
+
+    async def __call__(self, request: Request):
+        times = get_settings().rate_limits.get(self.name, self.times)
+
+        # Every route has its own bucket for every client
+        route = request.scope.get("route")
+        key = f"{self.name}:{getattr(route, 'path', request.url.path)}:{await limiter_identifier(request)}"
+
+        retry_after = rate_limit_store.hit(key, times, self.seconds)
+
+        if retry_after:
+            raise HTTPException(status_code=429, detail="Too Many Requests", headers={"Retry-After": str(retry_after)})
@@ -1,37 +1,27 @@
+import hashlib
+import json
+from enum import Enum
 from functools import lru_cache
-from typing import Union
+from typing import Any, Optional, Type, Union
 
-from shapely import Point, Polygon, MultiPolygon
+from shapely import Polygon, MultiPolygon
 from tortoise.models import Model
 from tortoise import fields
 
 
-def get_search_query(*args: str) -> str:
-    raw_query = (
-        "SELECT id, name, group_, tsv, "
-        "similarity(name, $1) AS similarity, ts_headline('simple', name, query) AS highlighted FROM ("
-    )
-
-    # args contain table names, so we can use them to build the query
-    for i, index in enumerate(args):
-        raw_query += (
-            f"SELECT id, name, '{index}' AS group_, tsv, CASE WHEN $1 = '' THEN '' "
-            f"ELSE to_tsquery('simple', CAST(plainto_tsquery('simple', $1) AS text) || ':*') "
-            f"END AS query FROM map_index_{index}"
-        )
-
-        # Add UNION ALL if not last index
-        if i < len(args) - 1:
-            raw_query += " UNION ALL "
-
-    raw_query += ") AS combined WHERE tsv @@ query ORDER BY similarity DESC LIMIT $2;"
-    return raw_query
+def get_fingerprint(model: Type[Model], item: Any) -> int:
+    """Hash of fields pulled from API, stored to detect changes without loading whole rows"""
+    values = [getattr(item, api_field) for api_field in model.api_fields.values()]
+    digest = hashlib.blake2b(json.dumps(values, default=str).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
 
 
 class House(Model):
     id = fields.IntField(pk=True)
     x = fields.FloatField(null=False)
     y = fields.FloatField(null=False)
+    map_x = fields.FloatField(null=False)
+    map_y = fields.FloatField(null=False)
     title = fields.CharField(max_length=255, null=False)
     location = fields.ForeignKeyField("models.Zone", null=True)
     owner = fields.ForeignKeyField("models.Player", on_delete=fields.SET_NULL, null=True)
@@ -39,6 +29,7 @@ class House(Model):
     price = fields.DecimalField(max_digits=10, decimal_places=2, null=False)
     expires = fields.DatetimeField(null=True)
     last_update = fields.DatetimeField(null=False, auto_now=True)
+    fingerprint = fields.BigIntField(null=True)
 
     # Dict of fields to be updated from API
     api_fields = {
@@ -51,15 +42,47 @@ class House(Model):
 
     class Meta:
         table = "map_houses"
+        indexes = (("x", "y"),)
 
     def __str__(self):
         return f"{self.id}. {self.title}"
 
 
+class ChangeAction(str, Enum):
+    UPSERT = "upsert"
+    DELETE = "delete"
+
+
+class HouseChange(Model):
+    id = fields.BigIntField(pk=True)
+    house_id = fields.IntField(null=False)
+    action = fields.CharEnumField(ChangeAction, max_length=6, null=False)
+    created = fields.DatetimeField(null=False, auto_now_add=True, index=True)
+
+    class Meta:
+        table = "map_house_changes"
+
+    def __str__(self):
+        return f"{self.id}. {self.action.value} {self.house_id}"
+
+    @staticmethod
+    async def get_cursor() -> int:
+        change = await HouseChange.all().order_by("-id").first()
+        return change.id if change else 0
+
+    @staticmethod
+    async def is_pruned(cursor: int) -> bool:
+        """Tell if changes following given cursor were already pruned from the log"""
+        change = await HouseChange.all().order_by("id").first()
+        return change is not None and change.id > cursor + 1
+
+
 class Blip(Model):
     id = fields.IntField(pk=True)
     x = fields.FloatField(null=False)
     y = fields.FloatField(null=False)
+    map_x = fields.FloatField(null=False)
+    map_y = fields.FloatField(null=False)
     name = fields.CharField(max_length=255, null=False)
     icon = fields.CharField(max_length=255, null=False)
 
@@ -114,15 +137,15 @@ class Zone(Model):
         return self.name
 
     @staticmethod
-    async def get_zone(x: float, y: float) -> "Zone":
-        point = Point(x, y)
-        city_zone = next(zone for zone in await Zone.filter(root_id__isnull=True) if point in zone)
+    async def get_zone(x: float, y: float) -> Optional["Zone"]:
+        # Imported here, as zone registry is built on top of this model
+        from mapapylife.zones import zone_registry
 
-        for zone in await Zone.filter(root_id=city_zone.id):
-            if point in zone:
-                return zone
+        if not zone_registry.loaded:
+            await zone_registry.load()
 
-        return city_zone
+        zone = zone_registry.locate(x, y)
+        return await Zone.get(id=zone.id) if zone else None
 
 
 class Player(Model):
@@ -131,6 +154,7 @@ class Player(Model):
     premium = fields.DatetimeField(null=True)
     registered = fields.DatetimeField(null=False)
     last_online = fields.DatetimeField(null=False)
+    fingerprint = fields.BigIntField(null=True)
 
     # Dict of fields to be updated from API
     api_fields = {
@@ -152,6 +176,7 @@ class Organization(Model):
     tag = fields.CharField(max_length=255, null=False)
     logo_url = fields.TextField(null=True)
     registered = fields.DatetimeField(null=False)
+    fingerprint = fields.BigIntField(null=True)
 
     # Dict of fields to be updated from API
     api_fields = {
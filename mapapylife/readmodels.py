@@ -0,0 +1,51 @@
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from pypika import Parameter
+from tortoise.queryset import ValuesQuery
+
+from mapapylife.db import get_read_connection
+from mapapylife.models import House
+
+# Fields of houses and their relations, pulled as flat rows with a single joined query
+HOUSE_FIELDS = (
+    "id",
+    "x",
+    "y",
+    "map_x",
+    "map_y",
+    "title",
+    "location_id",
+    "location__name",
+    "location__root__name",
+    "owner_id",
+    "owner__login",
+    "owner__premium",
+    "organization_id",
+    "organization__name",
+    "organization__logo_url",
+    "price",
+    "expires",
+    "last_update",
+)
+
+
+def query_house_rows(*args, **kwargs) -> ValuesQuery:
+    """Get houses as flat rows, zones, owners and organizations are joined in the same statement"""
+    return House.filter(*args, **kwargs).order_by("id").values(*HOUSE_FIELDS)
+
+
+@lru_cache()
+def get_house_row_sql() -> str:
+    # Statement text never changes, so asyncpg prepares it once per connection
+    return House.filter(id=Parameter("$1")).first().values(*HOUSE_FIELDS).sql()
+
+
+async def get_house_row(house_id: int) -> Optional[Dict[str, Any]]:
+    connection = get_read_connection()
+
+    if connection.capabilities.dialect == "postgres":
+        rows = await connection.execute_query_dict(get_house_row_sql(), [house_id])
+        return rows[0] if rows else None
+
+    return await House.filter(id=house_id).first().values(*HOUSE_FIELDS)
@@ -1,10 +1,29 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+
 from fastapi import APIRouter, Request, Response
 from fastapi.templating import Jinja2Templates
 
+from mapapylife.cache import Snapshot
+
 router = APIRouter()
 templates = Jinja2Templates(directory="mapapylife/templates")
 
+# Index page only changes between deploys, so it is rendered once per host
+pages: "OrderedDict[str, Snapshot]" = OrderedDict()
+PAGES_SIZE = 16
+
 
 @router.get("/", include_in_schema=False)
 async def get_index(request: Request) -> Response:
-    return templates.TemplateResponse("index.jinja2", context={"request": request})
+    key = str(request.base_url)
+
+    if key not in pages:
+        html = templates.get_template("index.jinja2").render(request=request)
+        pages[key] = Snapshot(html.encode(), media_type="text/html", last_modified=datetime.now(timezone.utc))
+
+        # Host header comes from clients, so number of rendered pages is bounded
+        while len(pages) > PAGES_SIZE:
+            pages.popitem(last=False)
+
+    return pages[key].to_response(request)
@@ -1,4 +1,6 @@
-from typing import Annotated
+import hashlib
+from datetime import datetime, timezone
+from typing import Annotated, Any, Dict, Tuple
 
 try:
     import rapidjson as json
@@ -8,35 +10,56 @@ except ImportError:
 from fastapi import APIRouter, HTTPException, Request, Response, Query
 from fastapi.templating import Jinja2Templates
 
-from mapapylife.models import House
+from mapapylife.cache import Snapshot, SnapshotCache
+from mapapylife.config import get_settings
+from mapapylife.readmodels import get_house_row
 
 router = APIRouter(prefix="/widget")
 templates = Jinja2Templates(directory="mapapylife/templates")
+snapshots = SnapshotCache(size=get_settings().widget_cache_size)
 
+# Data shown in widgets, read again only when houses change
+houses = SnapshotCache(size=get_settings().widget_cache_size)
 
-@router.get("/{house_id}", include_in_schema=False)
-async def get_house(request: Request, house_id: int, zoom: Annotated[int, Query(ge=0, le=7)] = 5) -> Response:
-    house = await House.get_or_none(id=house_id).prefetch_related("location", "owner")
 
+async def load_house_data(house_id: int) -> Tuple[str, Dict[str, Any]]:
+    house = await get_house_row(house_id)
+
+    # Missing houses are not cached, so requests for them cannot evict widgets of existing ones
     if not house:
         raise HTTPException(status_code=404, detail="House not found")
 
     data = {
-        "id": house.id,
-        "x": 3000 + house.x,
-        "y": 3000 - house.y,
-        "title": house.title,
-        "location": house.location.name,
-        "owner": house.owner.login if house.owner else None,
-        "price": house.price,
-        "expires": house.expires,
+        "id": house["id"],
+        "x": house["map_x"],
+        "y": house["map_y"],
+        "title": house["title"],
+        "location": house["location__name"],
+        "owner": house["owner__login"],
+        "price": house["price"],
+        "expires": house["expires"],
     }
 
-    return templates.TemplateResponse(
-        "widget.jinja2",
-        context={
-            "request": request,
-            "data": json.dumps(data, default=str),
-            "zoom": zoom,
-        },
+    # Fingerprint tells if the widget changed, as owner details change without touching the house row
+    fingerprint = hashlib.blake2b(json.dumps(data, default=str).encode(), digest_size=16).hexdigest()
+    return fingerprint, data
+
+
+async def build_house_widget(request: Request, data: Dict[str, Any], zoom: int) -> Snapshot:
+    html = templates.get_template("widget.jinja2").render(
+        request=request,
+        data=json.dumps(data, default=str),
+        zoom=zoom,
     )
+
+    return Snapshot(html.encode(), media_type="text/html", last_modified=datetime.now(timezone.utc))
+
+
+@router.get("/{house_id}", include_in_schema=False)
+async def get_house(request: Request, house_id: int, zoom: Annotated[int, Query(ge=0, le=7)] = 5) -> Response:
+    fingerprint, data = await houses.get("houses", house_id, lambda: load_house_data(house_id))
+
+    # Rendered widgets are valid until data of their house changes, URLs of static files depend on host
+    key = (str(request.base_url), house_id, zoom)
+    snapshot = await snapshots.get_validated(key, fingerprint, lambda: build_house_widget(request, data, zoom), shared=True)
+    return snapshot.to_response(request)
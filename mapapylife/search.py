@@ -0,0 +1,486 @@
+import asyncio
+import heapq
+import json
+import re
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional, Set, Tuple
+
+import numpy as np
+from tortoise import connections
+
+from mapapylife.cache import SingleFlight, build_consistently, build_shared, get_events_epoch, get_shared_name, get_version, read_consistently
+from mapapylife.config import get_settings
+from mapapylife.db import get_read_connection
+from mapapylife.models import Blip, ChangeAction, Event, House, HouseChange, Organization, Player, Zone
+
+# Groups of rows in search index, only zones and houses are searched unless asked otherwise
+SearchGroup = Literal["zones", "houses", "players", "organizations", "blips", "events"]
+DEFAULT_SEARCH_GROUPS = ("zones", "houses")
+
+# Matches are ranked first, so headlines are only generated for returned rows.
+# Statement text never changes, so asyncpg prepares it once per connection.
+SEARCH_QUERY = (
+    "SELECT id, name, group_, tsv, similarity, ts_headline('simple', name, query) AS highlighted FROM ("
+    "SELECT id, name, group_, tsv, similarity(name, $1) AS similarity, query FROM map_search_index, ("
+    "SELECT CASE WHEN numnode(plainto_tsquery('simple', $1)) = 0 THEN '' "
+    "ELSE to_tsquery('simple', CAST(plainto_tsquery('simple', $1) AS text) || ':*') END AS query"
+    ") AS parsed WHERE group_ = ANY($3) AND tsv @@ query ORDER BY name <-> $1 LIMIT $2"
+    ") AS ranked ORDER BY similarity DESC;"
+)
+
+# Lexemes in text representation of tsvector, quotes inside them are doubled
+LEXEME_PATTERN = re.compile(r"'((?:[^']|'')*)'")
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+# Only queries of plain words are tokenized here exactly like by the database parser
+SIMPLE_QUERY_PATTERN = re.compile(r"[^\W_]+(?: [^\W_]+)*")
+
+SearchRows = List[Dict[str, Any]]
+SearchFetch = Callable[[str, int, Tuple[str, ...]], Awaitable[SearchRows]]
+DocumentKey = Tuple[str, int]
+
+
+def normalize_query(query: str) -> str:
+    """Normalize query the same way the database does, so equivalent queries share cache entries"""
+    return " ".join(query.lower().split())
+
+
+def get_tokens(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+
+def parse_tsvector(value: str) -> Set[str]:
+    return {lexeme.replace("''", "'") for lexeme in LEXEME_PATTERN.findall(value)}
+
+
+def matches_tokens(word: str, tokens: List[str]) -> bool:
+    # Only the last token of query is matched as prefix, like in SEARCH_QUERY
+    return word in tokens[:-1] or word.startswith(tokens[-1])
+
+
+def get_trigrams(text: str) -> Set[str]:
+    """Get trigrams of text the way pg_trgm does, every word is padded with spaces"""
+    trigrams = set()
+
+    for word in get_tokens(text):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    return trigrams
+
+
+def get_similarity(common: int, a: int, b: int) -> float:
+    """Get similarity of two texts from numbers of their trigrams"""
+    if not a or not b:
+        return 0.0
+
+    # pg_trgm returns single precision floats
+    return float(np.float32(common / (a + b - common)))
+
+
+def highlight(name: str, tokens: List[str]) -> str:
+    """Wrap matched words in bold tags, like ts_headline with default options"""
+    return WORD_PATTERN.sub(lambda match: f"<b>{match[0]}</b>" if matches_tokens(match[0].lower(), tokens) else match[0], name)
+
+
+def filter_rows(rows: SearchRows, query: str, limit: int) -> SearchRows:
+    """Get results of query from complete results of its shorter prefix"""
+    tokens = get_tokens(query)
+    query_trigrams = get_trigrams(query)
+    results = []
+
+    for row in rows:
+        lexemes = parse_tsvector(row["tsv"])
+
+        if all(token in lexemes for token in tokens[:-1]) and any(lexeme.startswith(tokens[-1]) for lexeme in lexemes):
+            trigrams = get_trigrams(row["name"])
+
+            results.append({
+                **row,
+                "similarity": get_similarity(len(trigrams & query_trigrams), len(trigrams), len(query_trigrams)),
+                "highlighted": highlight(row["name"], tokens),
+            })
+
+    results.sort(key=lambda row: row["similarity"], reverse=True)
+    return results[:limit]
+
+
+def dump_rows(rows: SearchRows) -> Dict[str, bytes]:
+    return {"rows": json.dumps(rows).encode()}
+
+
+def load_rows(fields: Dict[bytes, bytes]) -> SearchRows:
+    return json.loads(fields[b"rows"])
+
+
+class SearchCache:
+    """In-process LRU cache of search results, valid until search index changes"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.version: Optional[int] = None
+        self.epoch: Optional[int] = None
+        self.entries: "OrderedDict[Tuple[Tuple[str, ...], str, Optional[int]], SearchRows]" = OrderedDict()
+        self.flights = SingleFlight()
+
+    def get(self, groups: Tuple[str, ...], query: str, limit: Optional[int]) -> Optional[SearchRows]:
+        rows = self.entries.get((groups, query, limit))
+
+        if rows is not None:
+            self.entries.move_to_end((groups, query, limit))
+
+        return rows
+
+    def put(self, groups: Tuple[str, ...], query: str, limit: Optional[int], rows: SearchRows):
+        self.entries[(groups, query, limit)] = rows
+        self.entries.move_to_end((groups, query, limit))
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def get_prefix(self, groups: Tuple[str, ...], query: str) -> Optional[SearchRows]:
+        # Every match of query also matches its prefixes, so complete results of prefix can be filtered
+        for length in range(len(query), 0, -1):
+            rows = self.get(groups, query[:length], None)
+
+            if rows is not None:
+                return rows
+
+        return None
+
+    async def fetch(self, version: int, query: str, limit: int, groups: Tuple[str, ...], fetch: SearchFetch) -> SearchRows:
+        # Identical searches are run once, by only one process at a time
+        name = get_shared_name("search", version, groups, query, limit)
+
+        return await self.flights.run(
+            (version, groups, query, limit),
+            lambda: build_shared(name, lambda: build_consistently(partial(fetch, query, limit, groups)), dump_rows, load_rows),
+        )
+
+    async def search(self, query: str, limit: int, groups: Tuple[str, ...], fetch: SearchFetch) -> SearchRows:
+        version = await get_version("search")
+
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+        # Events change without bumping the version, so results including them are dropped periodically
+        epoch = get_events_epoch()
+
+        if epoch != self.epoch:
+            for key in [key for key in self.entries if "events" in key[0]]:
+                del self.entries[key]
+
+            self.epoch = epoch
+
+        query = normalize_query(query)
+        rows = self.get(groups, query, limit)
+
+        if rows is not None:
+            return rows
+
+        prefix_rows = self.get_prefix(groups, query) if SIMPLE_QUERY_PATTERN.fullmatch(query) else None
+
+        if prefix_rows is not None:
+            rows = filter_rows(prefix_rows, query, limit)
+        else:
+            rows = await self.fetch(version, query, limit, groups, fetch)
+
+        self.put(groups, query, limit, rows)
+
+        # Results below limit contain every match, so they can serve longer queries too
+        if len(rows) < limit:
+            self.put(groups, query, None, rows)
+
+        return rows
+
+
+@dataclass
+class SearchDocument:
+    id: int
+    group: str
+    name: str
+    lexemes: Set[str]
+    trigrams: Set[str]
+
+    @property
+    def key(self) -> DocumentKey:
+        return self.group, self.id
+
+
+class TrieNode:
+    __slots__ = ("children", "words", "prefixed")
+
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        self.words: Set[DocumentKey] = set()
+        self.prefixed: Set[DocumentKey] = set()
+
+
+class SearchIndex:
+    """Prefix trie of words together with inverted index of trigrams, matched and ranked like the database"""
+
+    def __init__(self):
+        self.documents: Dict[DocumentKey, SearchDocument] = {}
+        self.trie = TrieNode()
+        self.trigrams: Dict[str, Set[DocumentKey]] = {}
+
+    def add(self, group: str, id: int, name: str):
+        self.remove(group, id)
+
+        document = SearchDocument(id=id, group=group, name=name, lexemes=set(get_tokens(name)), trigrams=get_trigrams(name))
+        self.documents[document.key] = document
+
+        for lexeme in document.lexemes:
+            node = self.trie
+
+            for char in lexeme:
+                node = node.children.setdefault(char, TrieNode())
+                node.prefixed.add(document.key)
+
+            node.words.add(document.key)
+
+        for trigram in document.trigrams:
+            self.trigrams.setdefault(trigram, set()).add(document.key)
+
+    def remove(self, group: str, id: int):
+        document = self.documents.pop((group, id), None)
+
+        if not document:
+            return
+
+        for lexeme in document.lexemes:
+            node = self.trie
+
+            for char in lexeme:
+                node = node.children[char]
+                node.prefixed.discard(document.key)
+
+            node.words.discard(document.key)
+
+        for trigram in document.trigrams:
+            self.trigrams[trigram].discard(document.key)
+
+    def remove_group(self, group: str):
+        for key in [key for key in self.documents if key[0] == group]:
+            self.remove(*key)
+
+    def find(self, word: str, prefix: bool) -> Set[DocumentKey]:
+        node = self.trie
+
+        for char in word:
+            node = node.children.get(char)
+
+            if node is None:
+                return set()
+
+        return node.prefixed if prefix else node.words
+
+    def search(self, query: str, limit: int, groups: Tuple[str, ...]) -> SearchRows:
+        tokens = get_tokens(query)
+
+        if not tokens:
+            return []
+
+        # Documents have to contain every word of query, the last one can be just started
+        matches = sorted([self.find(token, False) for token in tokens[:-1]] + [self.find(tokens[-1], True)], key=len)
+        candidates = {key for key in set(matches[0]).intersection(*matches[1:]) if key[0] in groups}
+
+        # Shared trigrams are counted from posting lists, limited to matched documents
+        query_trigrams = get_trigrams(query)
+        common = dict.fromkeys(candidates, 0)
+
+        for trigram in query_trigrams:
+            for key in candidates.intersection(self.trigrams.get(trigram, ())):
+                common[key] += 1
+
+        ranked = heapq.nsmallest(limit, (
+            (-get_similarity(count, len(self.documents[key].trigrams), len(query_trigrams)), key)
+            for key, count in common.items()
+        ))
+
+        return [
+            {
+                "id": key[1],
+                "name": self.documents[key].name,
+                "group_": key[0],
+                "similarity": -similarity,
+                "highlighted": highlight(self.documents[key].name, tokens),
+            }
+            for similarity, key in ranked
+        ]
+
+
+def get_house_name(house: Dict[str, Any]) -> str:
+    return f"{house['id']}. {house['title']} ({house['location__name'] or 'San Andreas'})"
+
+
+# Names of rows in every group are the same as written to map_search_index by triggers
+async def get_zone_names() -> List[Tuple[int, str]]:
+    zones = await Zone.all().values("id", "name", "root__name")
+    return [(zone["id"], f"{zone['name']}, {zone['root__name']}" if zone["root__name"] else zone["name"]) for zone in zones]
+
+
+async def get_house_names(*args, **kwargs) -> List[Tuple[int, str]]:
+    return [(house["id"], get_house_name(house)) for house in await House.filter(*args, **kwargs).values("id", "title", "location__name")]
+
+
+async def get_player_names() -> List[Tuple[int, str]]:
+    return await Player.all().values_list("id", "login")
+
+
+async def get_organization_names() -> List[Tuple[int, str]]:
+    return [(organization_id, f"{name} [{tag}]") for organization_id, name, tag in await Organization.all().values_list("id", "name", "tag")]
+
+
+async def get_blip_names() -> List[Tuple[int, str]]:
+    return await Blip.all().values_list("id", "name")
+
+
+async def get_event_names() -> List[Tuple[int, str]]:
+    return [(event_id, f"{name} ({location})") for event_id, name, location in await Event.all().values_list("id", "name", "location__name")]
+
+
+# Groups reloaded as a whole when version of their dataset changes, houses are caught up from change log instead
+SEARCH_LOADERS: Dict[str, Callable[[], Awaitable[List[Tuple[int, str]]]]] = {
+    "zones": get_zone_names,
+    "players": get_player_names,
+    "organizations": get_organization_names,
+    "blips": get_blip_names,
+    "events": get_event_names,
+}
+
+
+class SearchBackend(ABC):
+    async def start(self):
+        pass
+
+    @abstractmethod
+    async def search(self, query: str, limit: int, groups: Tuple[str, ...] = DEFAULT_SEARCH_GROUPS) -> SearchRows:
+        """Get rows matching query, best matches first"""
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Full-text search over index table maintained by triggers from mapapylife.sql"""
+
+    def __init__(self, cache_size: int):
+        self.cache = SearchCache(cache_size)
+
+    @staticmethod
+    async def fetch(query: str, limit: int, groups: Tuple[str, ...]) -> SearchRows:
+        return await get_read_connection().execute_query_dict(SEARCH_QUERY, [query, limit, list(groups)])
+
+    async def search(self, query: str, limit: int, groups: Tuple[str, ...] = DEFAULT_SEARCH_GROUPS) -> SearchRows:
+        return await self.cache.search(query, limit, groups, self.fetch)
+
+
+class MemorySearchBackend(SearchBackend):
+    """Search over index kept in memory, caught up from change log when houses change"""
+
+    def __init__(self):
+        self.index = SearchIndex()
+        self.cursor: Optional[int] = None
+        self.version: Optional[int] = None
+        self.versions: Dict[str, int] = {}
+        self.epoch: Optional[int] = None
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    async def load_group(index: SearchIndex, group: str):
+        names = await SEARCH_LOADERS[group]()
+        index.remove_group(group)
+
+        for row_id, name in names:
+            index.add(group, row_id, name)
+
+    async def load(self):
+        # Cursor is read first, so changes made in the meantime are replayed later
+        cursor = await HouseChange.get_cursor()
+        index = SearchIndex()
+
+        for group in SEARCH_LOADERS:
+            await self.load_group(index, group)
+
+        for house_id, name in await get_house_names():
+            index.add("houses", house_id, name)
+
+        # New index replaces the old one at once, searches never see it half built
+        self.index = index
+        self.cursor = cursor
+
+    async def catch_up(self):
+        changes = await HouseChange.filter(id__gt=self.cursor).order_by("id").values_list("id", "house_id", "action")
+
+        if not changes:
+            return
+
+        # Only the latest action of every house matters
+        actions = {house_id: action for _, house_id, action in changes}
+        upserted = [house_id for house_id, action in actions.items() if action == ChangeAction.UPSERT]
+
+        for house_id, action in actions.items():
+            if action == ChangeAction.DELETE:
+                self.index.remove("houses", house_id)
+
+        if upserted:
+            for house_id, name in await get_house_names(id__in=upserted):
+                self.index.add("houses", house_id, name)
+
+        self.cursor = changes[-1][0]
+
+    async def refresh(self):
+        """Bring index up to date with the current version of search index and period of events"""
+        version = await get_version("search")
+        epoch = get_events_epoch()
+
+        if version == self.version and epoch == self.epoch:
+            return
+
+        async with self.lock, read_consistently():
+            if version == self.version and epoch == self.epoch:
+                return
+
+            versions = {group: await get_version(group) for group in SEARCH_LOADERS}
+
+            # Everything is loaded again, if zones or change log were recreated, since names of houses include zones,
+            # or if changes following the cursor were already pruned from the log
+            stale = self.cursor is None or await HouseChange.get_cursor() < self.cursor or await HouseChange.is_pruned(self.cursor)
+
+            if stale or versions["zones"] != self.versions.get("zones"):
+                await self.load()
+            else:
+                for group in SEARCH_LOADERS:
+                    # Events change without bumping their version, so they are loaded again in every period
+                    if versions[group] != self.versions.get(group) or (group == "events" and epoch != self.epoch):
+                        await self.load_group(self.index, group)
+
+                await self.catch_up()
+
+            self.version = version
+            self.versions = versions
+            self.epoch = epoch
+
+    async def start(self):
+        await self.refresh()
+
+    async def search(self, query: str, limit: int, groups: Tuple[str, ...] = DEFAULT_SEARCH_GROUPS) -> SearchRows:
+        await self.refresh()
+        return self.index.search(normalize_query(query), limit, groups)
+
+
+@lru_cache()
+def get_search_backend() -> SearchBackend:
+    """Get search backend chosen in settings, Postgres full-text search is only available with Postgres database"""
+    settings = get_settings()
+    backend = settings.search_backend
+
+    if backend is None:
+        backend = "postgres" if connections.get("default").capabilities.dialect == "postgres" else "memory"
+
+    if backend == "postgres":
+        return PostgresSearchBackend(settings.search_cache_size)
+
+    return MemorySearchBackend()
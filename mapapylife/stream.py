@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from mapapylife.cache import HOUSES_CHANNEL, build_consistently, get_redis, read_consistently
+from mapapylife.models import HouseChange
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeBroadcaster:
+    """Fans out cursors published on a Redis channel to clients connected to this process"""
+
+    def __init__(self, channel: str, get_cursor: Callable[[], Awaitable[int]]):
+        self.channel = channel
+        self.get_cursor = get_cursor
+        self.cursor = 0
+        self.changed = asyncio.Event()
+        self.payloads: Dict[Hashable, asyncio.Future] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.notify(await self.get_cursor())
+        self.task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def listen(self):
+        while True:
+            try:
+                async with get_redis().pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+
+                    # Catch up with changes published while not subscribed
+                    self.notify(await self.get_cursor())
+
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.notify(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Subscription to "{self.channel}" failed: {e}, retrying...')
+                await asyncio.sleep(5)
+
+    def notify(self, cursor: int):
+        if cursor <= self.cursor:
+            return
+
+        self.cursor = cursor
+        self.payloads.clear()
+
+        # Wake up all waiting clients, new waiters get a fresh event
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def resync(self):
+        """Read the latest cursor again, it goes back if change log was recreated"""
+        async with read_consistently():
+            cursor = await self.get_cursor()
+
+        if cursor >= self.cursor:
+            self.notify(cursor)
+            return
+
+        self.cursor = cursor
+        self.payloads.clear()
+
+    async def wait(self, cursor: int, timeout: float) -> int:
+        """Wait until there are changes newer than given cursor, return the latest cursor"""
+        if self.cursor <= cursor:
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self.cursor
+
+    async def get_payload(self, key: Hashable, build: Callable[[], Awaitable[Any]]) -> Any:
+        """Build payload once for all clients waiting for the same changes"""
+        if key not in self.payloads:
+            self.payloads[key] = asyncio.ensure_future(build_consistently(build))
+
+        future = self.payloads[key]
+
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if self.payloads.get(key) is future:
+                del self.payloads[key]
+
+            raise
+
+    def discard(self, key: Hashable):
+        self.payloads.pop(key, None)
+
+
+house_broadcaster = ChangeBroadcaster(HOUSES_CHANNEL, HouseChange.get_cursor)
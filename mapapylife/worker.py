@@ -1,14 +1,26 @@
 import asyncio
 import logging
+import signal
 import sys
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, TypeVar
 
+import numpy as np
+from aiohttp import ClientError, ClientResponseError
 from pylife_api import PylifeAPIClient
+from pylife_api import Organization as APIOrganization, Player as APIPlayer
+from redis.exceptions import RedisError
 from shapely.speedups import available
-from tortoise import Tortoise, connections
+from tortoise import Tortoise, connections, timezone
+from tortoise.transactions import in_transaction
 
+from mapapylife.cache import HOUSES_CHANNEL, bump_versions, get_redis
 from mapapylife.config import get_settings
-from mapapylife.models import House, Organization, Player, Zone
+from mapapylife.coords import to_map
+from mapapylife.db import get_tortoise_config
+from mapapylife.models import ChangeAction, House, HouseChange, Organization, Player, get_fingerprint
+from mapapylife.zones import zone_registry
 
 # Enable logging
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -17,75 +29,215 @@ logger = logging.getLogger("worker")
 # Get settings
 settings = get_settings()
 
+# Number of rows written by a single INSERT statement
+BATCH_SIZE = 1000
 
-async def update_houses():
+# Key of advisory lock held by transactions writing log of house changes
+HOUSE_CHANGES_LOCK = 7291001
+
+# Datasets changed in database, but not yet notified to API because Redis was not reachable
+unnotified: Set[str] = set()
+
+T = TypeVar("T")
+
+
+class SyncState:
+    """Fingerprints of rows last written by the worker, carried between cycles when running as daemon"""
+
+    def __init__(self):
+        self.houses: Optional[Dict[int, Optional[int]]] = None
+        self.players: Optional[Dict[int, Optional[int]]] = None
+        self.organizations: Optional[Dict[int, Optional[int]]] = None
+        self.loaded_at = time.monotonic()
+
+    def clear(self):
+        # Next cycle will load current rows from database again
+        self.houses = None
+        self.players = None
+        self.organizations = None
+        self.loaded_at = time.monotonic()
+
+    # Only IDs and fingerprints are loaded, instead of whole rows
+    async def get_houses(self) -> Dict[int, Optional[int]]:
+        if self.houses is None:
+            self.houses = dict(await House.all().values_list("id", "fingerprint"))
+
+        return self.houses
+
+    async def get_players(self) -> Dict[int, Optional[int]]:
+        if self.players is None:
+            self.players = dict(await Player.all().values_list("id", "fingerprint"))
+
+        return self.players
+
+    async def get_organizations(self) -> Dict[int, Optional[int]]:
+        if self.organizations is None:
+            self.organizations = dict(await Organization.all().values_list("id", "fingerprint"))
+
+        return self.organizations
+
+
+async def fetch_many(ids: Iterable[int], fetch: Callable[[int], Awaitable[T]]) -> List[T]:
+    # Limit number of concurrent requests to API
+    semaphore = asyncio.Semaphore(settings.worker_concurrency)
+
+    async def fetch_one(item_id: int):
+        async with semaphore:
+            for attempt in range(settings.worker_retries + 1):
+                try:
+                    return await fetch(item_id)
+                except Exception as e:
+                    # Only connection and server errors, or rate limiting, may go away by retrying
+                    if isinstance(e, ClientResponseError):
+                        retryable = e.status >= 500 or e.status == 429
+                    else:
+                        retryable = isinstance(e, (ClientError, asyncio.TimeoutError))
+
+                    if not retryable or attempt == settings.worker_retries:
+                        logger.error(f"Could not pull ID {item_id} from API: {e}")
+                        return None
+
+                    delay = settings.worker_retry_delay * 2 ** attempt
+                    logger.warning(f"Pulling ID {item_id} from API failed: {e}, retrying in {delay} seconds...")
+                    await asyncio.sleep(delay)
+
+    results = await asyncio.gather(*(fetch_one(item_id) for item_id in ids))
+    return [result for result in results if result is not None]
+
+
+async def save_players(players: List[APIPlayer]) -> List[Player]:
+    rows = [
+        Player(
+            id=player.id,
+            login=player.login,
+            premium=player.premium,
+            registered=player.registered,
+            last_online=player.last_online,
+            fingerprint=get_fingerprint(Player, player),
+        )
+        for player in players
+    ]
+
+    # Insert or update players in bulk
+    await Player.bulk_create(
+        rows,
+        batch_size=BATCH_SIZE,
+        on_conflict=["id"],
+        update_fields=["login", "premium", "registered", "last_online", "fingerprint"],
+    )
+
+    return rows
+
+
+async def save_organizations(organizations: List[APIOrganization]) -> List[Organization]:
+    rows = [
+        Organization(
+            id=organization.id,
+            name=organization.name,
+            tag=organization.tag,
+            logo_url=str(organization.logo) if organization.logo else None,
+            registered=organization.registered,
+            fingerprint=get_fingerprint(Organization, organization),
+        )
+        for organization in organizations
+    ]
+
+    # Insert or update organizations in bulk
+    await Organization.bulk_create(
+        rows,
+        batch_size=BATCH_SIZE,
+        on_conflict=["id"],
+        update_fields=["name", "tag", "logo_url", "registered", "fingerprint"],
+    )
+
+    return rows
+
+
+async def log_house_changes(upserted: Iterable[int] = (), deleted: Iterable[int] = ()):
+    # Append changes to log read by clients synchronizing houses
+    changes = [HouseChange(house_id=house_id, action=ChangeAction.UPSERT) for house_id in upserted]
+    changes += [HouseChange(house_id=house_id, action=ChangeAction.DELETE) for house_id in deleted]
+
+    if not changes:
+        return
+
+    # IDs are taken at insert, not at commit, so writers take turns until they commit.
+    # Otherwise a transaction holding a lower ID could commit later, and clients which already moved past it would miss it.
+    connection = connections.get("default")
+
+    if connection.capabilities.dialect == "postgres":
+        await connection.execute_query("SELECT pg_advisory_xact_lock($1)", [HOUSE_CHANGES_LOCK])
+
+    await HouseChange.bulk_create(changes)
+
+
+async def notify_house_changes(*datasets: str):
+    # Invalidate cached snapshots and wake up clients streaming changes, together with other changed datasets
+    datasets = sorted(unnotified.union(("houses", *datasets)))
+
+    try:
+        await bump_versions(*datasets)
+        await get_redis().publish(HOUSES_CHANNEL, await HouseChange.get_cursor())
+    except RedisError as e:
+        # Changes are already committed, so they are notified again after the next job
+        logger.warning(f"Could not notify API about changes of {', '.join(datasets)}: {e!r}")
+        unnotified.update(datasets)
+        return
+
+    unnotified.clear()
+
+
+async def update_houses(client: PylifeAPIClient, state: SyncState):
     # List containing houses to be updated
     updates = []
 
     # List of available house ids
     available_ids = set()
 
-    # Load current houses from database
-    houses = {house.id: house for house in await House.all()}
+    # Get last seen houses, players and organizations
+    houses = await state.get_houses()
+    players = await state.get_players()
+    organizations = await state.get_organizations()
 
-    # Prefetch player and organization IDs from database
-    players = set(await Player.all().values_list("id", flat=True))
-    organizations = set(await Organization.all().values_list("id", flat=True))
+    # Get all houses from API, together with players and organizations missing in database
+    logger.info("Pulling houses from API...")
+    api_houses = await client.get_houses()
 
-    # Get all houses from API
-    async with PylifeAPIClient(auth_token=settings.auth_token) as client:
-        logger.info("Pulling houses from API...")
-
-        for house in await client.get_houses():
-            # Check if player exists in database
-            if house.owner and house.owner not in players:
-                logger.info(f"Player with ID {house.owner} not found in database, pulling from API...")
-                player = await client.get_player(house.owner)
-
-                # Add player to database
-                await Player.create(
-                    id=player.id,
-                    login=player.login,
-                    premium=player.premium,
-                    registered=player.registered,
-                    last_online=player.last_online,
-                )
-
-                # Add player ID to list
-                players.append(player.id)
-
-            # Check if organization exists in database
-            if house.organization and house.organization not in organizations:
-                logger.info(f"Organization with ID {house.organization} not found in database, pulling from API...")
-                organization = await client.get_organization(house.organization)
-
-                # Add organization to database
-                await Organization.create(
-                    id=organization.id,
-                    name=organization.name,
-                    tag=organization.tag,
-                    logo_url=organization.logo,
-                    registered=organization.registered,
-                )
-
-                # Add organization ID to list
-                organizations.append(organization.id)
-
-            # Add house to available IDs
-            available_ids.add(house.id)
-
-            # Get current house from database
-            old_house = houses.get(house.id)
-
-            if not old_house:
-                logger.warning(f'House "{house.title}" with ID {house.id} does not exist in database!')
-                updates.append(house)
-            else:
-                # Check if house has changed
-                for field, api_field in House.api_fields.items():
-                    if getattr(old_house, field) != getattr(house, api_field):
-                        updates.append(house)
-                        break
+    missing_players = {house.owner for house in api_houses if house.owner and house.owner not in players}
+    missing_organizations = {house.organization for house in api_houses if house.organization and house.organization not in organizations}
+
+    if missing_players or missing_organizations:
+        logger.info(
+            f"Pulling {len(missing_players)} player(s) and {len(missing_organizations)} organization(s) "
+            f"not found in database from API..."
+        )
+
+    new_players, new_organizations = await asyncio.gather(
+        fetch_many(missing_players, client.get_player),
+        fetch_many(missing_organizations, client.get_organization),
+    )
+
+    # Pulled players and organizations are known from now on
+    new_player_ids = {player.id for player in new_players}
+    new_organization_ids = {organization.id for organization in new_organizations}
+
+    for house in api_houses:
+        # Add house to available IDs
+        available_ids.add(house.id)
+
+        # Skip house until its owner or organization can be pulled from API
+        if (house.owner and house.owner not in players and house.owner not in new_player_ids) or (
+            house.organization and house.organization not in organizations and house.organization not in new_organization_ids
+        ):
+            logger.warning(f'Skipping house "{house.title}" with ID {house.id}, its owner or organization is missing!')
+            continue
+
+        if house.id not in houses:
+            logger.warning(f'House "{house.title}" with ID {house.id} does not exist in database!')
+            updates.append(house)
+        elif houses[house.id] != get_fingerprint(House, house):
+            # Fingerprint of house differs from the one of last written row
+            updates.append(house)
 
     # Output number of houses to be updated
     if len(updates) > 0:
@@ -93,69 +245,122 @@ async def update_houses():
     else:
         logger.info("Everything up-to-date, nothing to do.")
 
-    # Update houses
-    for house in updates:
-        logger.info(f'Updating house "{house.title}" with ID {house.id}...')
+    # Resolve zones of new houses in one batch
+    new_houses = [house for house in updates if house.id not in houses]
+    locations = {}
 
-        # Prepare default values
-        defaults = {
-            "title": house.title,
-            "owner_id": house.owner,
-            "organization_id": house.organization,
-            "price": house.price,
-            "expires": house.expires,
-        }
+    if new_houses:
+        if not zone_registry.loaded:
+            await zone_registry.load()
 
-        # Check if house does not exist in database
-        if house.id not in houses:
-            logger.info("House does not exist in database, adding new house...")
+        zones = zone_registry.locate_many(
+            [house.position.x for house in new_houses],
+            [house.position.y for house in new_houses],
+        )
+
+        locations = {house.id: zone.id if zone else None for house, zone in zip(new_houses, zones)}
 
-            # Get zone from house position
-            zone = await Zone.get_zone(house.position.x, house.position.y)
+    # Houses that are no longer available
+    deleted = [house_id for house_id in houses if house_id not in available_ids]
 
-            # Add position to default values
-            defaults.update({
-                "x": house.position.x,
-                "y": house.position.y,
-                "location_id": zone.id,
-            })
+    # Search index only changes together with titles, positions are never updated
+    changed_ids = [house.id for house in updates if house.id in houses]
+    titles = dict(await House.filter(id__in=changed_ids).values_list("id", "title")) if changed_ids else {}
+    datasets = set()
 
-        # Update or create house in database
-        await House.update_or_create(id=house.id, defaults=defaults)
+    if new_houses or deleted or any(house.title != titles[house.id] for house in updates if house.id in titles):
+        datasets.add("search")
 
-    # Delete houses that are no longer available
-    for house in houses.values():
-        if house.id not in available_ids:
-            logger.info(f'Deleting house "{house.title}" with ID {house.id}...')
+    # Players and organizations pulled here are new rows of search index too
+    if new_players:
+        datasets.update(("players", "search"))
 
-            # Delete house from database
-            await house.delete()
+    if new_organizations:
+        datasets.update(("organizations", "search"))
 
+    # Houses and log of their changes are written in one transaction
+    async with in_transaction():
+        # Referenced players and organizations have to be written first
+        player_rows = await save_players(new_players)
+        organization_rows = await save_organizations(new_organizations)
 
-async def update_players():
+        for house in updates:
+            if house.id not in houses:
+                logger.info(f'Adding house "{house.title}" with ID {house.id}...')
+            else:
+                logger.info(f'Updating house "{house.title}" with ID {house.id}...')
+
+        # Map coordinates are converted once here, instead of on every read
+        map_xs, map_ys = to_map(
+            np.array([house.position.x for house in updates], dtype=np.float64),
+            np.array([house.position.y for house in updates], dtype=np.float64),
+        )
+
+        # Insert new houses and update changed ones, position is only written for new houses
+        house_rows = [
+            House(
+                id=house.id,
+                x=house.position.x,
+                y=house.position.y,
+                map_x=map_x,
+                map_y=map_y,
+                title=house.title,
+                location_id=locations.get(house.id),
+                owner_id=house.owner,
+                organization_id=house.organization,
+                price=house.price,
+                expires=house.expires,
+                fingerprint=get_fingerprint(House, house),
+            )
+            for house, map_x, map_y in zip(updates, map_xs.tolist(), map_ys.tolist())
+        ]
+
+        await House.bulk_create(
+            house_rows,
+            batch_size=BATCH_SIZE,
+            on_conflict=["id"],
+            update_fields=["title", "owner_id", "organization_id", "price", "expires", "last_update", "fingerprint"],
+        )
+
+        for house_id in deleted:
+            logger.info(f"Deleting house with ID {house_id}...")
+
+        # Delete houses in one statement, search index rows are removed by the delete_search_index trigger
+        if deleted:
+            await House.filter(id__in=deleted).delete()
+
+        await log_house_changes([house.id for house in updates], deleted)
+
+    # Remember fingerprints of written rows for the next cycle
+    players.update({player.id: player.fingerprint for player in player_rows})
+    organizations.update({organization.id: organization.fingerprint for organization in organization_rows})
+    houses.update({house.id: house.fingerprint for house in house_rows})
+
+    for house_id in deleted:
+        del houses[house_id]
+
+    # Notify API about committed changes
+    if updates or deleted:
+        await notify_house_changes(*sorted(datasets))
+
+
+async def update_players(client: PylifeAPIClient, state: SyncState):
     # List containing players to be updated
     updates = []
 
-    # Load current players from database
-    players = {player.id: player for player in await Player.all()}
+    # Get last seen players
+    players = await state.get_players()
 
     # Get all players from API
-    async with PylifeAPIClient(auth_token=settings.auth_token) as client:
-        logger.info("Pulling players from API...")
+    logger.info("Pulling players from API...")
 
-        for player in await client.get_players():
-            # Get current player from database
-            old_player = players.get(player.id)
-
-            if not old_player:
-                logger.warning(f'Player "{player.login}" with ID {player.id} does not exist in database!')
-                updates.append(player)
-            else:
-                # Check if player has changed
-                for field, api_field in Player.api_fields.items():
-                    if getattr(old_player, field) != getattr(player, api_field):
-                        updates.append(player)
-                        break
+    for player in await client.get_players():
+        if player.id not in players:
+            logger.warning(f'Player "{player.login}" with ID {player.id} does not exist in database!')
+            updates.append(player)
+        elif players[player.id] != get_fingerprint(Player, player):
+            # Fingerprint of player differs from the one of last written row
+            updates.append(player)
 
     # Output number of players to be updated
     if len(updates) > 0:
@@ -163,46 +368,51 @@ async def update_players():
     else:
         logger.info("Everything up-to-date, nothing to do.")
 
-    # Update players
-    for player in updates:
-        logger.info(f'Updating player "{player.login}" with ID {player.id}...')
+    async with in_transaction():
+        for player in updates:
+            logger.info(f'Updating player "{player.login}" with ID {player.id}...')
 
-        # Update player in database
-        await Player.update_or_create(
-            id=player.id,
-            defaults={
-                "login": player.login,
-                "premium": player.premium,
-                "registered": player.registered,
-                "last_online": player.last_online,
-            },
-        )
+        # Fingerprint does not tell which fields changed, so previous values are read for changed players only
+        previous = {}
+
+        if updates:
+            rows = await Player.filter(id__in=[player.id for player in updates]).values_list("id", "login", "premium")
+            previous = {player_id: (login, premium) for player_id, login, premium in rows}
+
+        player_rows = await save_players(updates)
+
+        # Houses include login and premium of their owners, so they are reported as changed
+        owners = [player.id for player in updates if previous.get(player.id) != (player.login, player.premium)]
 
+        if owners:
+            await log_house_changes(await House.filter(owner_id__in=owners).values_list("id", flat=True))
 
-async def update_organizations():
+    # Remember written rows for the next cycle
+    players.update({player.id: player.fingerprint for player in player_rows})
+
+    # Notify API about committed changes, search index only changes with logins
+    if updates:
+        renamed = any(player.login != previous.get(player.id, (None, None))[0] for player in updates)
+        await notify_house_changes(*(("players", "search") if renamed else ()))
+
+
+async def update_organizations(client: PylifeAPIClient, state: SyncState):
     # List containing organizations to be updated
     updates = []
 
-    # Load current organizations from database
-    organizations = {organization.id: organization for organization in await Organization.all()}
+    # Get last seen organizations
+    organizations = await state.get_organizations()
 
     # Get all organizations from API
-    async with PylifeAPIClient(auth_token=settings.auth_token) as client:
-        logger.info("Pulling organizations from API...")
+    logger.info("Pulling organizations from API...")
 
-        for organization in await client.get_organizations():
-            # Get current organization from database
-            old_organization = organizations.get(organization.id)
-
-            if not old_organization:
-                logger.warning(f'Organization "{organization.name}" with ID {organization.id} does not exist in database!')
-                updates.append(organization)
-            else:
-                # Check if organization has changed
-                for field, api_field in Organization.api_fields.items():
-                    if getattr(old_organization, field) != getattr(organization, api_field):
-                        updates.append(organization)
-                        break
+    for organization in await client.get_organizations():
+        if organization.id not in organizations:
+            logger.warning(f'Organization "{organization.name}" with ID {organization.id} does not exist in database!')
+            updates.append(organization)
+        elif organizations[organization.id] != get_fingerprint(Organization, organization):
+            # Fingerprint of organization differs from the one of last written row
+            updates.append(organization)
 
     # Output number of organizations to be updated
     if len(updates) > 0:
@@ -210,20 +420,41 @@ async def update_organizations():
     else:
         logger.info("Everything up-to-date, nothing to do.")
 
-    # Update organizations
-    for organization in updates:
-        logger.info(f'Updating organization "{organization.name}" with ID {organization.id}...')
+    async with in_transaction():
+        for organization in updates:
+            logger.info(f'Updating organization "{organization.name}" with ID {organization.id}...')
+
+        # Previous names are read for changed organizations only, to tell if search index changed
+        previous = {}
+
+        if updates:
+            rows = await Organization.filter(id__in=[organization.id for organization in updates]).values_list("id", "name", "tag")
+            previous = {organization_id: (name, tag) for organization_id, name, tag in rows}
+
+        organization_rows = await save_organizations(updates)
+
+        # Houses include organization details, so they are reported as changed
+        if updates:
+            await log_house_changes(await House.filter(organization_id__in=[organization.id for organization in updates]).values_list("id", flat=True))
+
+    # Remember written rows for the next cycle
+    organizations.update({organization.id: organization.fingerprint for organization in organization_rows})
+
+    # Notify API about committed changes, search index only changes with names and tags
+    if updates:
+        renamed = any(previous.get(organization.id) != (organization.name, organization.tag) for organization in updates)
+        await notify_house_changes(*(("organizations", "search") if renamed else ()))
 
-        # Update organization in database
-        await Organization.update_or_create(
-            id=organization.id,
-            defaults={
-                "name": organization.name,
-                "tag": organization.tag,
-                "logo_url": organization.logo,
-                "registered": organization.registered,
-            },
-        )
+
+async def prune_house_changes(client: PylifeAPIClient, state: SyncState):
+    # Clients behind the oldest kept change are asked to load all houses again
+    cutoff = timezone.now() - timedelta(seconds=settings.house_changes_max_age)
+
+    # The latest change is always kept, so cursor of the log never goes back
+    cursor = await HouseChange.get_cursor()
+    deleted = await HouseChange.filter(created__lt=cutoff, id__lt=cursor).delete()
+
+    logger.info(f"Pruned {deleted} house change(s) older than {cutoff}.")
 
 
 async def run_job(job_name: str):
@@ -233,25 +464,100 @@ async def run_job(job_name: str):
     logger.info(f"Cron job started at {start_time}")
     logger.info(f'Running job "{job_name}"...')
 
-    # Connect to database
-    await Tortoise.init(db_url=settings.db_url, modules={"models": ["mapapylife.models"]})
+    # Connect to database, worker always reads from the primary it writes to
+    await Tortoise.init(config=get_tortoise_config(replica=False))
 
     try:
-        await globals()[job_name]()
+        async with PylifeAPIClient(auth_token=settings.auth_token) as client:
+            await globals()[job_name](client, SyncState())
     except asyncio.CancelledError:
         pass
 
-    # Disconnect from database
+    # Disconnect from database and Redis
     await connections.close_all()
+    await get_redis().close()
 
     elapsed_time = (datetime.now() - start_time).total_seconds()
     logger.info(f"Done! Job finished in {round(elapsed_time, 2)} seconds.")
 
 
+async def run_cycle(job: Callable[[PylifeAPIClient, SyncState], Awaitable[None]], client: PylifeAPIClient, state: SyncState):
+    start_time = time.monotonic()
+    logger.info(f'Running job "{job.__name__}"...')
+
+    try:
+        await job(client, state)
+    except Exception:
+        logger.exception(f'Job "{job.__name__}" failed, last seen rows will be reloaded from database.')
+        state.clear()
+        return
+
+    elapsed_time = time.monotonic() - start_time
+    logger.info(f'Job "{job.__name__}" finished in {round(elapsed_time, 2)} seconds.')
+
+    # Retry notification which did not get through to Redis before
+    if unnotified:
+        await notify_house_changes()
+
+
+async def serve():
+    logger.info("Worker started, running jobs in background...")
+
+    # Jobs with their intervals in seconds
+    jobs = {
+        update_houses: settings.worker_houses_interval,
+        update_players: settings.worker_players_interval,
+        update_organizations: settings.worker_organizations_interval,
+        prune_house_changes: settings.worker_prune_interval,
+    }
+
+    # Stop gracefully on signals, after the running job is finished
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    # Database pool, API session and last seen rows are kept for the whole lifetime
+    await Tortoise.init(config=get_tortoise_config(replica=False))
+    state = SyncState()
+    next_runs = {job: loop.time() for job in jobs}
+
+    async with PylifeAPIClient(auth_token=settings.auth_token) as client:
+        while not stop.is_set():
+            # Drop rows cached for too long, in case database was changed by someone else
+            if time.monotonic() - state.loaded_at > settings.worker_state_max_age:
+                state.clear()
+
+            for job, interval in jobs.items():
+                if not stop.is_set() and loop.time() >= next_runs[job]:
+                    await run_cycle(job, client, state)
+                    next_runs[job] += interval
+
+                    # Skip runs missed while jobs were running longer than their interval
+                    if next_runs[job] < loop.time():
+                        next_runs[job] = loop.time() + interval
+
+            # Sleep until the next job is due
+            try:
+                await asyncio.wait_for(stop.wait(), max(0.0, min(next_runs.values()) - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+
+    # Disconnect from database and Redis
+    await connections.close_all()
+    await get_redis().close()
+
+    logger.info("Worker stopped.")
+
+
 if __name__ == "__main__":
     # Check if job was specified
     if len(sys.argv) < 2:
         print("No job specified!")
         exit(1)
 
-    asyncio.run(run_job(sys.argv[1]))
+    if sys.argv[1] == "serve":
+        asyncio.run(serve())
+    else:
+        asyncio.run(run_job(sys.argv[1]))
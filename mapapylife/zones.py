@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from mapapylife.cache import get_version, read_consistently
+from mapapylife.config import get_settings
+from mapapylife.coords import MAP_OFFSET, MAP_SIZE
+from mapapylife.models import Zone
+
+# Zoom levels of the map, each of them doubles the scale of the previous one
+MIN_ZOOM = 0
+MAX_ZOOM = 7
+
+# Special raster values, every other value is a zone ID
+RASTER_EMPTY = 0
+RASTER_BOUNDARY = np.iinfo(np.uint16).max
+
+# Grid of zone coordinates in raw units when zones are split into pieces, far below a pixel at the highest zoom level
+ZONE_PRECISION = 0.01
+
+
+def get_tolerance(zoom: int) -> float:
+    """Get size of one pixel in raw units at given zoom level, on map 256 pixels wide at zoom level 0"""
+    return MAP_SIZE / (256 * 2 ** zoom)
+
+
+def get_polygonal(geometry: shapely.Geometry) -> shapely.Geometry:
+    # Overlays of polygons touching each other also return their common lines and points
+    parts = [part for part in shapely.get_parts(geometry) if isinstance(part, shapely.Polygon) and not part.is_empty]
+    return shapely.MultiPolygon(parts) if len(parts) != 1 else parts[0]
+
+
+def simplify_zones(geometries: np.ndarray, roots: Sequence[Optional[int]], tolerance: float) -> np.ndarray:
+    """Simplify zone geometries, keeping borders shared by zones and their cities consistent.
+
+    Roots are indices of cities of zones, or None for cities. Zones and parts of cities outside of them
+    form a single coverage, which is simplified at once, cities are then put together from their parts.
+    """
+    # Overlays are computed on a fixed grid, so pieces share exactly the same vertices along their borders
+    geometries = shapely.set_precision(geometries, ZONE_PRECISION)
+    pieces, owners = [], []
+
+    for index, root in enumerate(roots):
+        if root is None:
+            children = [child for child, parent in enumerate(roots) if parent == index]
+            rest = shapely.difference(geometries[index], shapely.union_all(geometries[children], grid_size=ZONE_PRECISION), grid_size=ZONE_PRECISION) if children else geometries[index]
+            pieces.append(rest)
+            owners.append((index,))
+        else:
+            # Parts of zones outside of their cities do not belong to cities
+            pieces.append(shapely.intersection(geometries[index], geometries[root], grid_size=ZONE_PRECISION))
+            owners.append((index, root))
+            pieces.append(shapely.difference(geometries[index], geometries[root], grid_size=ZONE_PRECISION))
+            owners.append((index,))
+
+    pieces = np.array([get_polygonal(piece) for piece in pieces], dtype=object)
+    kept = ~shapely.is_empty(pieces)
+    pieces, owners = pieces[kept], [owner for owner, keep in zip(owners, kept) if keep]
+
+    # Coverage simplification is available since Shapely 2.1 and needs zones which do not overlap
+    if not hasattr(shapely, "coverage_simplify") or not shapely.coverage_is_valid(pieces):
+        return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+    pieces = shapely.coverage_simplify(pieces, tolerance)
+    parts: List[List[shapely.Geometry]] = [[] for _ in geometries]
+
+    for piece, owner in zip(pieces, owners):
+        for index in owner:
+            parts[index].append(piece)
+
+    # Shared edges of simplified pieces are identical, so they merge without gaps or slivers
+    simplified = np.empty(len(geometries), dtype=object)
+    simplified[:] = [get_polygonal(shapely.union_all(items)) for items in parts]
+    return simplified
+
+
+def encode_polyline(coords: np.ndarray) -> str:
+    """Encode integer coordinates as deltas of consecutive points, with polyline algorithm"""
+    deltas = np.diff(coords.astype(np.int64), axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    chars = []
+
+    # Sign is moved to the lowest bit, then value is split into chunks of five bits
+    for value in ((deltas << 1) ^ (deltas >> 63)).tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+
+        chars.append(chr(value + 63))
+
+    return "".join(chars)
+
+
+@dataclass(frozen=True)
+class ZoneEntry:
+    id: int
+    name: str
+    root: Optional["ZoneEntry"] = None
+
+    @property
+    def zone_name(self) -> Optional[str]:
+        return self.name if self.root else None
+
+    @property
+    def city_name(self) -> str:
+        return self.root.name if self.root else self.name
+
+    def __str__(self):
+        return self.name
+
+
+class ZoneRegistry:
+    """Process-wide spatial index of zones, kept in memory between requests"""
+
+    def __init__(self):
+        self.entries: List[ZoneEntry] = []
+        self.by_id: Dict[int, ZoneEntry] = {}
+        self.geometries = np.empty(0, dtype=object)
+        self.tree: Optional[STRtree] = None
+        self.raster: Optional[np.ndarray] = None
+        self.resolution: int = 0
+        self.version: Optional[int] = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.tree is not None
+
+    async def load(self):
+        settings = get_settings()
+
+        # Load zones from database, parents need to be known before children
+        zones = await Zone.all().order_by("id")
+        by_id = {}
+
+        for zone in sorted(zones, key=lambda z: z.root_id is not None):
+            root = by_id.get(zone.root_id) if zone.root_id else None
+            by_id[zone.id] = ZoneEntry(id=zone.id, name=zone.name, root=root)
+
+        # Child zones are tested before city zones, like in lookup ordered by root_id
+        zones.sort(key=lambda z: (z.root_id is None, z.root_id or 0, z.id))
+
+        geometries = np.array([zone.get_polygon() for zone in zones], dtype=object)
+        shapely.prepare(geometries)
+
+        entries = [by_id[zone.id] for zone in zones]
+        tree = STRtree(geometries)
+        raster = None
+
+        # Load or build precomputed raster of zones, if enabled
+        if settings.zone_raster_dir:
+            digest = hashlib.sha1(
+                json.dumps([(zone.id, zone.root_id, zone.points) for zone in zones]).encode()
+            ).hexdigest()[:16]
+
+            path = os.path.join(
+                settings.zone_raster_dir,
+                f"zones-{settings.zone_raster_resolution}-{digest}.npy",
+            )
+
+            raster = self.get_raster(path, entries, tree, settings.zone_raster_resolution)
+
+        # Swap state at once, so concurrent lookups never see a partial index
+        self.entries = entries
+        self.by_id = by_id
+        self.geometries = geometries
+        self.tree = tree
+        self.raster = raster
+        self.resolution = settings.zone_raster_resolution
+
+    async def refresh(self):
+        """Load zones again, if they were changed since the last load"""
+        version = await get_version("zones")
+
+        if version == self.version:
+            return
+
+        # Concurrent requests wait for a single load
+        async with self.lock, read_consistently():
+            if version == self.version:
+                return
+
+            await self.load()
+            self.version = version
+
+    @staticmethod
+    def build_raster(entries: List[ZoneEntry], tree: STRtree, resolution: int) -> np.ndarray:
+        """Build a grid with the innermost zone ID of every cell"""
+        if MAP_SIZE % resolution != 0:
+            raise ValueError(f"Raster resolution must be a divisor of {MAP_SIZE}")
+
+        size = MAP_SIZE // resolution
+        edges = np.arange(size, dtype=np.float64) * resolution - MAP_OFFSET
+
+        # Rows of the grid follow the Y axis, columns follow the X axis
+        minx, miny = (edge.ravel() for edge in np.meshgrid(edges, edges))
+        cells = shapely.box(minx, miny, minx + resolution, miny + resolution)
+
+        # Cells lying entirely inside zones get the innermost of them
+        missing = len(entries)
+        matches = np.full(len(cells), missing, dtype=np.int64)
+        cell_indices, zone_indices = tree.query(cells, predicate="within")
+        np.minimum.at(matches, cell_indices, zone_indices)
+
+        zone_ids = np.array([entry.id for entry in entries] + [RASTER_EMPTY], dtype=np.uint16)
+        raster = zone_ids[matches]
+
+        # Cells crossed by a zone boundary need an exact test
+        for predicate in ("overlaps", "contains"):
+            cell_indices, _ = tree.query(cells, predicate=predicate)
+            raster[cell_indices] = RASTER_BOUNDARY
+
+        return raster.reshape(size, size)
+
+    def get_raster(self, path: str, entries: List[ZoneEntry], tree: STRtree, resolution: int) -> np.ndarray:
+        if any(not RASTER_EMPTY < entry.id < RASTER_BOUNDARY for entry in entries):
+            raise ValueError("Zone IDs do not fit into raster")
+
+        if not os.path.exists(path):
+            raster = self.build_raster(entries, tree, resolution)
+
+            # Write to temporary file first, as other workers may be reading the same path
+            temp_path = f"{path}.{os.getpid()}.tmp.npy"
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            np.save(temp_path, raster, allow_pickle=False)
+            os.replace(temp_path, path)
+
+        # Memory-mapped raster is shared between all processes through page cache
+        return np.load(path, mmap_mode="r", allow_pickle=False)
+
+    def get_raster_values(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Get zone IDs from raster for given raw coordinates, -1 if an exact test is needed"""
+        values = np.full(len(xs), -1, dtype=np.int64)
+
+        if self.raster is None:
+            return values
+
+        columns = (xs + MAP_OFFSET) / self.resolution
+        rows = (ys + MAP_OFFSET) / self.resolution
+        size = self.raster.shape[0]
+
+        # Points on cell edges may lie on a zone border, so they are tested exactly as well
+        valid = (
+            (columns > 0) & (columns < size) & (rows > 0) & (rows < size)
+            & (columns != np.floor(columns)) & (rows != np.floor(rows))
+        )
+
+        cells = self.raster[rows[valid].astype(np.int64), columns[valid].astype(np.int64)].astype(np.int64)
+        values[valid] = np.where(cells == RASTER_BOUNDARY, -1, cells)
+
+        return values
+
+    def locate(self, x: float, y: float) -> Optional[ZoneEntry]:
+        """Get the innermost zone containing given raw coordinates"""
+        if not self.loaded:
+            raise RuntimeError("Zone registry is not loaded")
+
+        value = int(self.get_raster_values(np.array([x], dtype=np.float64), np.array([y], dtype=np.float64))[0])
+
+        if value != -1:
+            return self.by_id.get(value)
+
+        # Geometries are sorted by priority, so the lowest index is the innermost zone
+        indices = self.tree.query(shapely.Point(x, y), predicate="within")
+
+        if len(indices) == 0:
+            return None
+
+        return self.entries[int(indices.min())]
+
+    def locate_many(self, xs: Sequence[float], ys: Sequence[float]) -> List[Optional[ZoneEntry]]:
+        """Get the innermost zones containing given raw coordinates, in bulk"""
+        if not self.loaded:
+            raise RuntimeError("Zone registry is not loaded")
+
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        values = self.get_raster_values(xs, ys)
+        results = [self.by_id.get(value) for value in values.tolist()]
+
+        # Only points which could not be resolved from raster are tested against polygons
+        exact = np.flatnonzero(values == -1)
+        points = shapely.points(xs[exact], ys[exact])
+        point_indices, zone_indices = self.tree.query(points, predicate="within")
+
+        # Keep the innermost zone for each point, points outside of any zone stay out of range
+        missing = len(self.entries)
+        matches = np.full(len(points), missing, dtype=np.int64)
+        np.minimum.at(matches, point_indices, zone_indices)
+
+        for index, match in zip(exact.tolist(), matches.tolist()):
+            results[index] = self.entries[match] if match != missing else None
+
+        return results
+
+
+zone_registry = ZoneRegistry()
@@ -7,7 +7,7 @@ var layers = {};
 var markers = {};
 var tilemaps = {};
 
-var last_update = null;
+var cursor = null;
 
 
 function setupLeaflet() {
@@ -88,8 +88,8 @@ function setupLeaflet() {
         houses: {}
     };
 
-    // set last update timestamp to 0
-    last_update = 0;
+    // change cursor is unknown until houses are loaded
+    cursor = null;
 
     // remove markers that are outside view bounds to improve performance
     map.on('zoomend moveend resize zoom move', function() {
@@ -379,7 +379,7 @@ function loadData() {
 
     // load house markers
     $.getJSON('/api/v1/points/houses', function(json) {
-        last_update = parseTimestamp(json.last_update);
+        cursor = json.cursor;
 
         json.data.forEach(function(house) {
             var layer = createHouseMarker(house).addTo(layers.houses);
@@ -436,11 +436,6 @@ function formatDate(timestamp) {
 }
 
 
-function parseTimestamp(timestamp) {
-    return parseInt(new Date(timestamp).getTime() / 1000, 10);
-}
-
-
 function setCookie(name, value, expiry) {
     var date = new Date();
     date.setTime(date.getTime() + (expiry * 24 * 60 * 60 * 1000));
@@ -475,42 +470,96 @@ function init() {
     // load all map data
     loadData();
 
-    // check every minute for updates
-    setInterval(function() {
-        $.getJSON('/api/v1/points/houses?last_update=' + last_update, function(json) {
-            var refresh = false;
-
-            // update last update timestamp if last_update is not null
-            last_update = json.last_update ? parseTimestamp(json.last_update) : last_update;
-
-            // update house markers
-            json.data.forEach(function(house) {
-                var marker = null;
-
-                if (markers.houses[house.id]) {
-                    marker = layers.houses.getLayer(markers.houses[house.id].layer);
-                    marker.setIcon(getHouseIcon(house));
-                    marker.setPopupContent(getHousePopupText(house));
-                } else {
-                    marker = createHouseMarker(house).addTo(layers.houses);
-                    refresh = true;
-                }
+    // receive updates as they happen, or check every minute for them
+    if (window.EventSource) {
+        streamHouses();
+    } else {
+        setInterval(syncHouses, 60000);
+    }
+}
 
-                markers.houses[house.id] = {
-                    name: house.name,
-                    location: house.location,
-                    owner: house.owner,
-                    price: house.price,
-                    layer: layers.houses.getLayerId(marker)
-                };
-            });
 
-            // refresh if houses were updated
-            if (refresh) {
-                checkVisibility('houses');
-            }
-        });
-    }, 60000);
+function streamHouses() {
+    // wait for initial houses, as stream starts from their cursor
+    if (cursor === null) {
+        setTimeout(streamHouses, 1000);
+        return;
+    }
+
+    var source = new EventSource('/api/v1/points/houses/stream?since=' + cursor);
+
+    source.onmessage = function(event) {
+        applyHouseChanges(JSON.parse(event.data));
+    };
+
+    // fall back to polling if stream cannot be reconnected
+    source.onerror = function() {
+        if (source.readyState === EventSource.CLOSED) {
+            setInterval(syncHouses, 60000);
+        }
+    };
+}
+
+
+function syncHouses() {
+    if (cursor === null) {
+        return;
+    }
+
+    $.getJSON('/api/v1/points/houses/changes?since=' + cursor, function(json) {
+        applyHouseChanges(json);
+
+        // fetch remaining changes right away
+        if (json.has_more) {
+            syncHouses();
+        }
+    });
+}
+
+
+function applyHouseChanges(json) {
+    var refresh = false;
+
+    // move cursor past received changes
+    cursor = json.cursor;
+
+    // update house markers
+    json.data.forEach(function(house) {
+        var marker = null;
+
+        if (markers.houses[house.id]) {
+            marker = layers.houses.getLayer(markers.houses[house.id].layer);
+            marker.setIcon(getHouseIcon(house));
+            marker.setPopupContent(getHousePopupText(house));
+        } else {
+            marker = createHouseMarker(house).addTo(layers.houses);
+            refresh = true;
+        }
+
+        markers.houses[house.id] = {
+            name: house.name,
+            location: house.location,
+            owner: house.owner,
+            price: house.price,
+            layer: layers.houses.getLayerId(marker)
+        };
+    });
+
+    // remove markers of deleted houses
+    json.deleted.forEach(function(id) {
+        if (markers.houses[id]) {
+            var marker = layers.houses.getLayer(markers.houses[id].layer);
+
+            layers.houses.removeLayer(marker);
+            map.removeLayer(marker);
+            delete markers.houses[id];
+        }
+    });
+
+    // refresh if houses were updated
+    if (refresh) {
+        checkVisibility('houses');
+    }
 }
 
 